@@ -39,7 +39,7 @@ def tanh(x):
 
 def relu(x):
     """Returns the rectified linear unit of the input."""
-    return (x * (x > 0)).to(dtype=torch.float32, device=x.device)
+    return (x * (x > 0)).to(dtype=x.dtype, device=x.device)
 
 def tanh_sig(x):
     """Returns the sigmoid of the hyperbolic tangent of the input."""
@@ -47,7 +47,7 @@ def tanh_sig(x):
 
 def pulse(x):
     """Return the pulse fn of the input."""
-    return 2.0*(x % 1 < .5) -1.0
+    return (2.0*(x % 1 < .5) -1.0).to(x.dtype)
 
 
 def hat(x):
@@ -70,13 +70,15 @@ def sqr(x):
 
 def elu(x):
     """Returns the exponential linear unit of the input."""
-    return torch.where(x > 0, x, torch.exp(x) - 1,).to(torch.float32)
+    return torch.where(x > 0, x, torch.exp(x) - 1,).to(x.dtype)
 
-@torch.enable_grad()
 def sin(x):
     """Returns the sine of the input."""
     # y =  torch.sin(x*math.pi)
-    y =  torch.sin(x)
+    if torch.is_inference_mode_enabled():
+        return torch.sin(x) # no graph to force (see CPPN.inference)
+    with torch.enable_grad():
+        y =  torch.sin(x)
     return y
 
 def cos(x):
@@ -0,0 +1,126 @@
+"""Renders CPPN animations over a time input, streaming the frames to disk."""
+import os
+
+import numpy as np
+import torch
+from torch import nn
+
+from cppn_torch.graph_util import aggregate
+from cppn_torch.render import postprocess_tile, to_uint8
+from cppn_torch.util import gaussian_blur
+
+
+def apply_activation(fn, X, node_shape):
+    """Applies an activation function to (..., h, w) values."""
+    if not isinstance(fn, nn.Module):
+        return fn(X)
+    # e.g. Conv2d needs the full image of every frame as a (1, h, w) channel
+    X = X.expand(*X.shape[:-2], *node_shape)
+    return fn(X.unsqueeze(-3)).squeeze(-3)
+
+
+class Animation:
+    """Evaluates the frames of a CPPN whose input channel `time_channel` is time.
+
+    Nodes that do not depend on time are evaluated once, when the animation
+    is created. For every batch of frames, only the time-dependent nodes are
+    evaluated, on values that broadcast over the frames: the time input is
+    (F, 1, 1) and time-independent values are (h, w), so nodes cost
+    O(F * h * w) only once they mix time and space.
+
+    The genome must not be changed while the animation is in use.
+    """
+
+    @torch.no_grad()
+    def __init__(self, cppn, inputs, time_channel=-1):
+        """inputs: (h, w, n_inputs) inputs, the time channel is ignored."""
+        self.cppn = cppn
+        self.node_shape = tuple(inputs.shape[:2])
+        self.time_channel = time_channel % inputs.shape[2]
+        self.plan = cppn.get_plan()
+        if self.plan.has_recurrent:
+            raise ValueError("Animations of recurrent networks are not supported.")
+        self.dependent = self.plan.dependent_positions([self.time_channel])
+        params = cppn.get_flat_params()
+        self.biases = self.plan.gather_biases(params).view(-1)
+        self.weights = self.plan.gather_weights(params)
+        self.static = {} # position -> (h, w) values of time-independent nodes
+        for pos in range(self.plan.num_nodes):
+            if pos not in self.dependent:
+                self.static[pos] = self.activate_node(pos, self.static, inputs)
+
+    def activate_node(self, pos, values, inputs):
+        """Returns the value of the node at `pos` given the values of its sources."""
+        plan = self.plan
+        fn = plan.activations[pos]
+        if plan.is_input(pos):
+            return apply_activation(fn, inputs[..., plan.input_channels[pos]] + self.biases[pos], self.node_shape)
+        sources = plan.source_positions[pos]
+        if len(sources) == 0:
+            X = torch.zeros(self.node_shape, dtype=self.biases.dtype, device=self.biases.device)
+        else:
+            start, end = plan.weight_slices[pos]
+            X = torch.stack(torch.broadcast_tensors(*[values[s] for s in sources]), dim=-1)
+            X = aggregate(X, self.weights[start:end], plan.aggs[pos])
+        return apply_activation(fn, X + self.biases[pos], self.node_shape)
+
+    @torch.no_grad()
+    def frames(self, times):
+        """Returns the (F, n_outputs, h, w) raw outputs at the given times."""
+        times = torch.as_tensor(times, dtype=self.biases.dtype, device=self.biases.device)
+        time_inputs = times.view(-1, 1, 1, 1).expand(-1, 1, 1, self.time_channel + 1)
+        values = dict(self.static)
+        for pos in sorted(self.dependent):
+            values[pos] = self.activate_node(pos, values, time_inputs)
+        shape = (times.shape[0], *self.node_shape)
+        zeros = torch.zeros(shape, dtype=self.biases.dtype, device=self.biases.device)
+        outputs = torch.stack([values[pos].expand(shape) if pos is not None else zeros
+                               for pos in self.plan.output_positions], dim=1)
+        if self.cppn.output_blur > 0:
+            outputs = gaussian_blur(outputs, self.cppn.output_blur)
+        return outputs
+
+
+def frame_times(time_range, fps):
+    """Returns the times of the frames of `time_range` (end excluded) at `fps`."""
+    start, end = time_range
+    return start + torch.arange(int(round((end - start) * fps)), dtype=torch.float64) / fps
+
+
+def render_animation(cppn, inputs, path, time_range=(0.0, 1.0), fps=24, time_channel=-1, batch_size=8):
+    """Renders an animation of the CPPN and streams it to `path`.
+
+    Frames are evaluated `batch_size` at a time (see `Animation`) and
+    written as they are rendered, so the sequence is never held in memory.
+    `.npy` paths get a (frames, h, w, C) float32 memmap, other paths are
+    written with an imageio writer (e.g. .gif) as 8-bit frames. Every frame
+    is normalized by itself, as by `ImageCPPN.get_image`.
+
+    returns:
+        The number of frames.
+    """
+    animation = Animation(cppn, inputs, time_channel)
+    times = frame_times(time_range, fps)
+    h, w = animation.node_shape
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(len(times), h, w, cppn.n_outputs))
+        def write(index, frame):
+            out[index] = frame.permute(1, 2, 0).cpu().numpy()
+        close = out.flush
+    else:
+        import imageio.v2 as iio
+        # the GIF writer takes the frame duration in ms instead of fps
+        writer = iio.get_writer(path, **({"duration": 1000 / fps} if ext == ".gif" else {"fps": fps}))
+        def write(index, frame):
+            frame = to_uint8(frame)
+            writer.append_data(frame[:, :, 0] if frame.shape[2] == 1 else frame)
+        close = writer.close
+    try:
+        for start in range(0, len(times), batch_size):
+            batch = animation.frames(times[start:start + batch_size])
+            for i, frame in enumerate(batch):
+                write(start + i, postprocess_tile(cppn, frame))
+    finally:
+        close()
+    return len(times)
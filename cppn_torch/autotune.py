@@ -0,0 +1,125 @@
+"""Chooses the activation mode of `act_mode='auto'` by measuring the candidates."""
+import json
+import logging
+import os
+import time
+
+import torch
+
+
+def bucket(n):
+    """Rounds n up to a power of two."""
+    return 1 << max(0, int(n) - 1).bit_length()
+
+
+def bucket_key(cppn, inputs, grad):
+    """Returns the table key of a genome and (H, W, n_inputs) inputs.
+
+    Genomes share a key if they have about as many nodes, as wide a widest
+    layer and as many activation groups (kernels per forward in the batched
+    modes), and are evaluated at about as many pixels on the same device.
+    """
+    plan = cppn.get_plan()
+    n_groups = sum(len(groups) for groups in plan.activation_groups())
+    width = max(len(layer) for layer in plan.layers)
+    return "/".join(map(str, (inputs.device.type, str(inputs.dtype).replace("torch.", ""), "grad" if grad else "no_grad",
+                              bucket(plan.num_nodes), bucket(width), bucket(n_groups),
+                              bucket(inputs.shape[0] * inputs.shape[1]))))
+
+
+def candidate_modes(cppn, inputs, grad):
+    """Returns the activation modes that can evaluate the genome."""
+    plan = cppn.get_plan()
+    modes = ['node', 'layer']
+    aggs = set(plan.aggs[pos] for layer in plan.layers[1:] for pos in layer)
+    if len(aggs) <= 1:
+        agg = aggs.pop() if aggs else 'sum'
+        if agg in ('sum', 'mean'):
+            modes.append('sparse')
+        modes.append('compiled')
+        if not grad:
+            modes.append('arena') # records no autograd graph
+    return modes
+
+
+class AutoTuner:
+    """A table of the fastest activation mode per bucket (see `bucket_key`),
+    stored as JSON at `path` (kept in memory if `path` is None).
+
+    The first forward in a bucket evaluates the genome `repeats` times with
+    every candidate mode and records the fastest one. Later forwards in the
+    bucket look the mode up in the table. Only forward passes are timed.
+    """
+
+    def __init__(self, path=None, repeats=3):
+        self.path = path
+        self.repeats = repeats
+        self.table = self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read activation mode table {self.path}: {e}")
+            return {}
+
+    def save(self):
+        """Writes the table, keeping entries that other processes added."""
+        if self.path is None:
+            return
+        table = self.load()
+        table.update(self.table)
+        self.table = table
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(table, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def choose(self, cppn, inputs):
+        """Returns the activation mode to evaluate the genome on `inputs` with."""
+        grad = cppn.needs_grad()
+        key = bucket_key(cppn, inputs, grad)
+        if key not in self.table:
+            self.table[key] = self.measure(cppn, inputs, grad)
+            logging.info(f"Using act_mode='{self.table[key]}' for {key}")
+            self.save()
+        return self.table[key]
+
+    def measure(self, cppn, inputs, grad):
+        """Returns the candidate mode with the shortest forward pass, or 'node'
+        if none of them can evaluate the genome."""
+        times = {}
+        for mode in candidate_modes(cppn, inputs, grad):
+            try:
+                cppn.evaluate(inputs, mode) # warm up, e.g. build kernels
+                best = float('inf')
+                for _ in range(self.repeats):
+                    if inputs.device.type == 'cuda':
+                        torch.cuda.synchronize(inputs.device)
+                    start = time.perf_counter()
+                    cppn.evaluate(inputs, mode)
+                    if inputs.device.type == 'cuda':
+                        torch.cuda.synchronize(inputs.device)
+                    best = min(best, time.perf_counter() - start)
+                times[mode] = best
+            except (ValueError, RuntimeError) as e:
+                logging.debug(f"act_mode='{mode}' is not available: {e}")
+        cppn.release_activations()
+        if len(times) == 0:
+            return 'node'
+        return min(times, key=times.get)
+
+
+tuners = {} # path -> AutoTuner, shared by all genomes
+
+
+def get_tuner(path=None):
+    """Returns the process-wide tuner of the table at `path` (or of the
+    in-memory table if `path` is None)."""
+    if path not in tuners:
+        tuners[path] = AutoTuner(path)
+    return tuners[path]
@@ -0,0 +1,200 @@
+"""Generates straight-line Torch kernels from CPPN execution plans."""
+from collections import OrderedDict
+import hashlib
+import logging
+import sys
+import warnings
+
+import torch
+
+from cppn_torch.gene import NodeType
+from cppn_torch.node_cache import cached_per_inputs
+
+
+def fn_name(fn):
+    """Returns a name that identifies an activation function.
+
+    Functions that can be looked up by their qualified name are named by it.
+    Other callables (lambdas, closures, `functools.partial` and callable
+    objects) can share a name, so their identity is added to it. Kernels
+    keep their functions alive, so an id is not reused while a kernel that
+    calls it is cached.
+    """
+    if isinstance(fn, torch.nn.Module):
+        raise ValueError(f"Cannot generate a kernel for module activation {type(fn).__name__}. Try `act_mode='node'`.")
+    module = getattr(fn, "__module__", None)
+    qualname = getattr(fn, "__qualname__", None)
+    if qualname is not None:
+        obj = sys.modules.get(module)
+        for part in qualname.split("."):
+            obj = getattr(obj, part, None)
+        if obj is fn:
+            return f"{module}.{qualname}"
+    return f"{module or type(fn).__module__}.{qualname or type(fn).__qualname__}@{id(fn):x}"
+
+
+def structural_hash(plan):
+    """Returns a canonical hash of a plan's topology and activation functions.
+
+    Weights and biases are not included, so clones and weight-only mutations
+    of a genome share the same hash.
+    """
+    if plan.structure_hash is not None:
+        return plan.structure_hash
+    description = [plan.agg]
+    for pos in range(plan.num_nodes):
+        description.append((int(plan.node_types[pos]),
+                            plan.input_channels.get(pos),
+                            fn_name(plan.activations[pos]),
+                            plan.source_positions[pos]))
+    description.append(tuple(plan.output_positions))
+    plan.structure_hash = hashlib.sha1(repr(description).encode()).hexdigest()
+    return plan.structure_hash
+
+
+@cached_per_inputs()
+def broadcast_shapes(inputs):
+    """Returns the smallest (h, w) per channel of (H, W, n_inputs) inputs that
+    broadcasts back to (H, W).
+
+    Channels that only vary along the height (e.g. y) are (H, 1), channels
+    that only vary along the width (e.g. x) are (1, W) and constant channels
+    (e.g. the input bias) are (1, 1). Shapes are cached per inputs tensor,
+    so the check costs one pass over a grid the first time it is evaluated.
+    """
+    along_h = (inputs == inputs[:1]).flatten(0, 1).all(dim=0)    # constant along H
+    along_w = (inputs == inputs[:, :1]).flatten(0, 1).all(dim=0) # constant along W
+    rows_equal, columns_equal = torch.stack((along_h, along_w)).tolist()
+    return tuple((1 if h else inputs.shape[0], 1 if w else inputs.shape[1])
+                 for h, w in zip(rows_equal, columns_equal))
+
+
+def broadcast_channels(inputs):
+    """Splits (H, W, n_inputs) inputs into per-channel views of their
+    broadcast shapes (see `broadcast_shapes`)."""
+    return tuple(inputs[:h, :w, c] for c, (h, w) in enumerate(broadcast_shapes(inputs)))
+
+
+def generate_source(plan, name="kernel"):
+    """Generates the source of a function `kernel(channels, like, params)`.
+
+    `channels` are the input channels in their broadcast shapes (see
+    `broadcast_channels`), `like` is an (H, W) tensor with the shape and dtype
+    of the outputs and `params` is one flat tensor holding the plan's weights (in
+    `cx_keys` order) followed by the biases of its nodes (in position order).
+    Nodes are evaluated in the broadcast shape of their inputs, so subgraphs
+    that only depend on y or x are evaluated in 1D and expanded to (H, W)
+    where they mix or at the outputs.
+
+    Returns (source, namespace) where the namespace maps the names used in
+    the source to functions.
+    """
+    agg = plan.agg
+    n_weights = len(plan.cx_keys)
+    needed = set(s for sources in plan.source_positions for s in sources)
+    needed.update(pos for pos in plan.output_positions if pos is not None)
+
+    namespace = {"torch": torch, "__name__": __name__}
+    fn_names = {}
+    lines = [f"def {name}(channels, like, params):",
+             "    p = params.unbind(0)"]
+    for pos in range(plan.num_nodes):
+        if pos not in needed:
+            continue # output never used
+        fn = plan.activations[pos]
+        key = fn_name(fn)
+        if key not in fn_names:
+            fn_names[key] = f"fn{len(fn_names)}"
+            namespace[fn_names[key]] = fn
+        bias = f"p[{n_weights + pos}]"
+        if plan.node_types[pos] == NodeType.INPUT:
+            x = f"channels[{plan.input_channels[pos]}]"
+        else:
+            start, _ = plan.weight_slices[pos]
+            terms = [f"n{s} * p[{start + i}]" for i, s in enumerate(plan.source_positions[pos])]
+            # sums are accumulated in the dtype of the params
+            sum_terms = [f"n{s}.to(params.dtype) * p[{start + i}]" for i, s in enumerate(plan.source_positions[pos])]
+            if len(terms) == 0:
+                x = "torch.zeros_like(like[:1, :1])" # sum of no inputs (see graph_optimizer)
+            elif agg == 'sum':
+                x = " + ".join(sum_terms)
+            elif agg == 'mean':
+                x = f"({' + '.join(sum_terms)}) / {len(terms)}"
+            elif agg in ('max', 'min'):
+                x = terms[0]
+                for term in terms[1:]:
+                    x = f"torch.{agg}imum({x}, {term})"
+            else:
+                raise ValueError(f"Unknown aggregation function {agg}")
+        lines.append(f"    n{pos} = {fn_names[key]}(({x} + {bias}).to(like.dtype))")
+
+    outputs = [f"n{pos}.expand_as(like)" if pos is not None else "torch.zeros_like(like)"
+               for pos in plan.output_positions]
+    lines.append(f"    return torch.stack([{', '.join(outputs)}])")
+    return "\n".join(lines) + "\n", namespace
+
+
+def build_kernel(plan, example_inputs, example_params, trace=True):
+    """Generates a kernel for the plan and traces it with TorchScript.
+
+    example_inputs: (channels, like) as passed to the kernel.
+
+    Falls back to the generated Python function if tracing fails.
+    """
+    source, namespace = generate_source(plan)
+    exec(compile(source, f"<cppn kernel {structural_hash(plan)[:8]}>", "exec"), namespace)
+    kernel = namespace["kernel"]
+    if not trace:
+        return kernel
+    try:
+        with warnings.catch_warnings():
+            # activations such as `linear` create constant tensors
+            warnings.simplefilter("ignore", torch.jit.TracerWarning)
+            warnings.simplefilter("ignore", FutureWarning) # deprecation of torch.jit.trace
+            return torch.jit.trace(kernel, (*example_inputs, example_params), check_trace=False)
+    except Exception as e:
+        logging.warning(f"Could not trace CPPN kernel, using generated Python function: {e}")
+        return kernel
+
+
+class KernelCache:
+    """A process-wide LRU cache of generated kernels keyed by structural hash."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.kernels = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, plan, inputs, params, trace=True):
+        """Returns the kernel for the plan, generating it on a cache miss.
+
+        inputs: (channels, like) as passed to the kernel.
+        """
+        like = inputs[1]
+        key = (structural_hash(plan), like.device.type, like.dtype, trace)
+        kernel = self.kernels.get(key)
+        if kernel is not None:
+            self.hits += 1
+            self.kernels.move_to_end(key)
+            return kernel
+        self.misses += 1
+        # constants recorded by the trace (see `linear`) must not be inference
+        # tensors, the kernel is shared with forward passes that need gradients
+        with torch.inference_mode(False), torch.no_grad():
+            kernel = build_kernel(plan, inputs, params.detach(), trace)
+        self.kernels[key] = kernel
+        while len(self.kernels) > self.maxsize:
+            self.kernels.popitem(last=False) # least recently used
+        return kernel
+
+    def clear(self):
+        self.kernels.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.kernels)
+
+
+kernel_cache = KernelCache()
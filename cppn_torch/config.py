@@ -23,8 +23,16 @@ class CPPNConfig:
         self.seed = None
         self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
         self.dtype = torch.float32
+        # dtype of the node values, weights and sums in the batched activation modes,
+        # e.g. torch.bfloat16 (None: same as the inputs); compiled kernels still add
+        # the terms of each sum in the dtype of the genome
+        self.compute_dtype = None
+        # re-render a sample of pixels in full precision and fall back to it if the
+        # largest error exceeds this (0 to disable)
+        self.precision_guard = 0.0
+        self.precision_guard_samples = 1024
         
-        self.activation_mode = "node" # "node", "layer", or "population" 
+        self.activation_mode = "node" # "node", "layer", "arena", "sparse", "compiled", "auto" or "population" 
         
         self.with_grad = False # calculate autograd graph during forward pass
         self.sgd_learning_rate = 0.01
@@ -41,6 +49,10 @@ class CPPNConfig:
         # self.color_mode = "L"
         
         self.allow_recurrent = False
+        # synchronous update steps of recurrent genomes, stopping early once no
+        # node value changes by more than the tolerance (0 to always run all steps)
+        self.recurrent_steps = 10
+        self.recurrent_tolerance = 0.0
         self.init_connection_probability = 0.85
         self.dense_init_connections = False
         self.activations = [sin, cos, gauss, linear, tanh]
@@ -49,6 +61,25 @@ class CPPNConfig:
         
         self.output_blur = 0.0 # don't blur
         
+        # 'off': no checks, 'final': one finiteness check of the outputs,
+        # 'per_node': check the inputs, weights and outputs of every node (slow)
+        self.validation = 'final'
+        
+        # evaluate a reduced graph when no gradients are needed (see graph_optimizer)
+        self.optimize_graph = False
+        # evaluate images only on their distinct input tuples when there are at most
+        # this fraction of the pixels, e.g. radially symmetric genomes (0 to disable)
+        self.dedup_inputs_fraction = 0.5
+        # bytes of node outputs to cache by subgraph hash when no gradients are
+        # needed, shared with clones so that offspring reuse unchanged nodes (0 to disable)
+        self.node_cache_bytes = 0
+        # evaluate the nodes of a layer on this many threads with act_mode='layer' on
+        # the CPU, e.g. at small resolutions (0 to disable, see layer_executor)
+        self.layer_threads = 0
+        # table of the fastest activation mode per genome size and resolution for
+        # act_mode='auto', a JSON file shared by processes (None: kept in memory, see autotune)
+        self.autotune_path = None
+        
         self.genome_type = None # algorithm default
         
         self.single_structural_mutation = False
@@ -219,6 +250,8 @@ class CPPNConfig:
             self.target = self.target_name
         
         self.dtype = str(self.dtype) # TODO deserialize 
+        if self.compute_dtype is not None:
+            self.compute_dtype = str(self.compute_dtype)
 
     def strings_to_fns(self):
         """Converts the activation functions to functions."""
@@ -253,6 +286,8 @@ class CPPNConfig:
         
         if isinstance(self.dtype, str):
             self.dtype = getattr(torch, self.dtype.removeprefix("torch."))
+        if isinstance(getattr(self, "compute_dtype", None), str):
+            self.compute_dtype = getattr(torch, self.compute_dtype.removeprefix("torch."))
         
         if hasattr(self, "fitness_function") and self.fitness_schedule is not None:
             for i, fn in enumerate(self.fitness_schedule):
@@ -1,12 +1,13 @@
 """Contains the CPPN, Node, and Connection classes."""
 import copy
+from collections import OrderedDict
+from contextlib import contextmanager
 from enum import IntEnum
 from itertools import count
 import math
 import json
 import os
 import random
-from cppn_torch.graph_util import activate_layer
 import torch
 from torch.nn import ConvTranspose2d, Conv2d
 import copy
@@ -15,12 +16,19 @@ from copyreg import dispatch_table
 import networkx as nx
 import logging
 from torch import nn
-from functorch.compile import compiled_function, draw_graph, aot_function
 from cppn_torch.activation_functions import identity
 import cppn_torch.activation_functions as af
 from cppn_torch.graph_util import *
 # from cppn_torch.config import CPPNConfig as Config
 from cppn_torch.gene import * 
+from cppn_torch.execution_plan import ExecutionPlan
+from cppn_torch.flat_params import FlatParams
+from cppn_torch.graph_optimizer import optimize_plan, constant_channels
+from cppn_torch.codegen import kernel_cache, broadcast_channels
+from cppn_torch.node_cache import NodeCache, subgraph_hash
+from cppn_torch.layer_executor import get_executor
+from cppn_torch.autotune import get_tuner
+from cppn_torch.fourier_features import apply_mapping
 from cppn_torch.util import upscale_conv2d, random_choice, random_normal, random_uniform, gaussian_blur
 
 from torchviz import make_dot
@@ -28,54 +36,113 @@ from torchviz import make_dot
 
 dtype = torch.float32
 
+
+def as_device(device):
+    """Returns `device` as a torch.device, with the index of the current CUDA
+    device if none is given, so that it compares equal to tensors' devices."""
+    device = torch.device(device)
+    if device.type == "cuda" and device.index is None:
+        device = torch.device("cuda", torch.cuda.current_device())
+    return device
+
+
+def coord_ranges(coord_range):
+    """Returns ((x_lo, x_hi), (y_lo, y_hi)) of `config.coord_range`, which is
+    either one range for both axes or an (x range, y range) pair, as tuples
+    or lists (e.g. from json)."""
+    if isinstance(coord_range[0], (tuple, list)):
+        range_x, range_y = coord_range
+    else:
+        # a single range for both x and y
+        range_x = range_y = coord_range
+    return (float(range_x[0]), float(range_x[1])), (float(range_y[0]), float(range_y[1]))
+
+
+def coordinate_values(coord_range, res_h, res_w, device, dtype=torch.float32):
+    """Returns the (y_vals, x_vals) of the pixels of a res_h x res_w grid,
+    linear within coord_range."""
+    (x_lo, x_hi), (y_lo, y_hi) = coord_ranges(coord_range)
+    x_vals = torch.linspace(x_lo, x_hi, res_w, device=device, dtype=dtype)
+    y_vals = torch.linspace(y_lo, y_hi, res_h, device=device, dtype=dtype)
+    return y_vals, x_vals
+
+
+def coordinate_inputs(coords, use_radial_dist, use_bias, n_inputs, B=None, sin_and_cos=False, out=None):
+    """Builds the inputs of broadcastable coordinate tensors, e.g. (y, x) of a
+    grid as (H, 1) and (1, W) tensors, or (y, x, z) of a volume.
+
+    Channels are the coordinates, the radial distance and the bias (if
+    used), then the Fourier features of (y, x) under the mapping B (see
+    `fourier_features.apply_mapping`) if it is given. Other channels are
+    zeros. `out` is filled in place if it is given.
+    """
+    shape = torch.broadcast_shapes(*(c.shape for c in coords))
+    n_fourier = 0 if B is None else B.shape[0] * (2 if sin_and_cos else 1)
+    n_base = n_inputs - n_fourier
+    if out is None:
+        out = torch.empty((*shape, n_inputs), dtype=coords[0].dtype, device=coords[0].device)
+    n_coords = len(coords)
+    for i, c in enumerate(coords):
+        out[..., i] = c
+    if use_radial_dist:
+        # d = sqrt(y^2 + x^2 (+ z^2))
+        out[..., n_coords] = torch.sqrt(sum(out[..., i]**2 for i in range(n_coords)))
+    out[..., n_coords + bool(use_radial_dist):n_base - bool(use_bias)] = 0.0
+    if use_bias:
+        out[..., n_base - 1] = 1.0 # bias = 1.0
+    if B is not None:
+        out[..., n_base:] = apply_mapping(out[..., :2], B, sin_and_cos)
+    return out
+
+
 class CPPN(nn.Module):
     """A CPPN Object with Nodes and Connections."""
 
-    constant_inputs = None # (res_h, res_w, n_inputs)
-    # constant_inputs = torch.zeros((0, 0, 0), dtype=torch.float32,requires_grad=False) # (res_h, res_w, n_inputs)
+    input_grids = OrderedDict() # key -> (inputs, version), see initialize_inputs
+    input_grids_size = 8
     current_id = 1 # 0 reserved for 'random' parent
     node_indexer = None
     
     
     @staticmethod
-    def initialize_inputs(res_h, res_w, use_radial_dist, use_bias, n_inputs, device, coord_range=(-.5,.5), type=None, dtype=torch.float32):
-        """Initializes the pixel inputs."""
-        if type is None:
-            type = __class__
-        
-        if not isinstance(coord_range[0], tuple):
-            # assume it's a single range for both x and y
-            coord_range_x = coord_range
-            coord_range_y = coord_range
-        else:
-            coord_range_x, coord_range_y = coord_range
-            
-        # Pixel coordinates are linear within coord_range
-        x_vals = torch.linspace(coord_range_x[0], coord_range_x[1], res_w, device=device,dtype=dtype)
-        y_vals = torch.linspace(coord_range_y[0], coord_range_y[1], res_h, device=device,dtype=dtype)
+    def initialize_inputs(res_h, res_w, use_radial_dist, use_bias, n_inputs, device, coord_range=(-.5,.5), type=None, dtype=torch.float32,
+                          B=None, sin_and_cos=False, share_memory=False):
+        """Returns the (res_h, res_w, n_inputs) pixel inputs.
 
-        # initialize to 0s
-        type.constant_inputs = torch.zeros((res_h, res_w, n_inputs), dtype=dtype, device=device, requires_grad=False)
+        Channels are laid out as in `coordinate_inputs`.
 
-        # assign values:
-        type.constant_inputs[:, :, 0] = y_vals.unsqueeze(1).repeat(1, res_w)
-        type.constant_inputs[:, :, 1] = x_vals.unsqueeze(0).repeat(res_h, 1)
-            
+        Grids are cached by their parameters (LRU, `input_grids_size` grids)
+        and shared by all callers, so they must not be modified in-place; a
+        grid that was modified anyway is rebuilt on the next call. With
+        `share_memory`, CPU grids are moved to shared memory so worker
+        processes can attach to them without copying.
+        """
+        if type is None:
+            type = __class__
         
-        if use_radial_dist:
-            # d = sqrt(x^2 + y^2)
-            type.constant_inputs[:, :, 2] = torch.sqrt(type.constant_inputs[:, :, 0]**2 + type.constant_inputs[:, :, 1]**2)
-        if use_bias:
-            type.constant_inputs[:, :, -1] = torch.ones((res_h, res_w), dtype=dtype, device=device, requires_grad=False) # bias = 1.0
+        range_x, range_y = coord_ranges(coord_range)
+        key = (res_h, res_w, range_x, range_y, bool(use_radial_dist), bool(use_bias), n_inputs,
+               None if B is None else (tuple(B.shape), B.detach().cpu().double().numpy().tobytes(), bool(sin_and_cos)),
+               dtype, str(torch.device(device)))
+        cache = type.input_grids
+        if key in cache:
+            inputs, version = cache[key]
+            if inputs._version == version and (inputs.is_shared() or not share_memory or inputs.device.type != "cpu"):
+                cache.move_to_end(key)
+                return inputs
         
-        repeat_dims = 2 # just y, x
-        if use_radial_dist:
-            repeat_dims += 1 # add radial dist
-        n_repeats = 0   
-        for i in range(n_repeats):
-            type.constant_inputs  = torch.cat((type.constant_inputs, type.constant_inputs[:, :, :repeat_dims]), dim=2)
+        with torch.inference_mode(False), torch.no_grad():
+            y_vals, x_vals = coordinate_values(coord_range, res_h, res_w, device, dtype)
+            inputs = coordinate_inputs((y_vals.unsqueeze(1), x_vals.unsqueeze(0)), use_radial_dist, use_bias,
+                                       n_inputs, B, sin_and_cos)
+            if share_memory and inputs.device.type == "cpu":
+                inputs.share_memory_()
         
-        return type.constant_inputs
+        cache[key] = (inputs, inputs._version)
+        cache.move_to_end(key)
+        while len(cache) > type.input_grids_size:
+            cache.popitem(last=False) # least recently used
+        return inputs
 
     @staticmethod
     def initialize_inputs_from_config(config):
@@ -88,9 +155,21 @@ class CPPN(nn.Module):
                                         config.device,
                                         config.coord_range,
                                         CPPN,
-                                        dtype
+                                        config.dtype
                                         )
 
+    @staticmethod
+    def point_inputs(coords, use_radial_dist, use_bias, n_inputs, B=None, sin_and_cos=False):
+        """Builds (N, 1, n_inputs) inputs for (N, 2) (y, x) coordinates.
+
+        Channels are laid out as in `coordinate_inputs`, without zero channels.
+        """
+        n_base = n_inputs - (0 if B is None else B.shape[0] * (2 if sin_and_cos else 1))
+        if n_base != 2 + use_radial_dist + use_bias:
+            raise ValueError(f"Point inputs have {2 + use_radial_dist + use_bias} coordinate channels, expected {n_base} of {n_inputs} inputs")
+        inputs = coordinate_inputs((coords[:, 0], coords[:, 1]), use_radial_dist, use_bias, n_inputs, B, sin_and_cos)
+        return inputs.unsqueeze(1)
+
     @staticmethod
     def get_id():
         __class__.current_id += 1
@@ -141,10 +220,9 @@ class CPPN(nn.Module):
     
    
     def reconfig(self, config = None, nodes = None, connections = None):
-        self.device = config.device
-            
-        if self.device is None:
+        if config.device is None:
             raise ValueError("device is None") 
+        self.device = as_device(config.device)
 
         self.n_outputs = len(config.color_mode) # RGB: 3, HSV: 3, L: 1
         self.n_in_nodes = config.num_inputs
@@ -164,9 +242,30 @@ class CPPN(nn.Module):
         
         self.output_blur = config.output_blur
         
+        if config.validation not in ('off', 'final', 'per_node'):
+            raise ValueError(f"Unknown validation level {config.validation}, should be 'off', 'final' or 'per_node'")
+        self.validation = config.validation
+        
+        self.compute_dtype = config.compute_dtype
+        self.precision_guard = config.precision_guard
+        self.precision_guard_samples = config.precision_guard_samples
+        
+        self.optimize_graph = config.optimize_graph
+        self.recurrent_steps = config.recurrent_steps
+        self.node_cache = NodeCache(config.node_cache_bytes) if config.node_cache_bytes > 0 else None
+        self.recurrent_tolerance = config.recurrent_tolerance
+        self.dedup_inputs_fraction = config.dedup_inputs_fraction
+        self.layer_threads = config.layer_threads
+        self.autotune_path = config.autotune_path
+        
         self.color_mode = config.color_mode
         
-        self.graph = {}
+        self.plan = None
+        self.reduced_plan = None # see get_eval_plan
+        self.flat_params = None # see get_flat_params
+        self.arena = None # node buffer for act_mode='arena'
+        self.guard_arena = None # node buffer for the samples of precision_guard
+        self.auto_act_mode = None # (key, act_mode) chosen for act_mode='auto'
         
 
     def get_new_node_id(self):
@@ -254,25 +353,15 @@ class CPPN(nn.Module):
         
 
     def get_params(self):
-        """Returns a list of all parameters in the network."""
-        params = []
+        """Returns the leaf tensors to optimize: the flat weight and bias
+        vectors (see `get_flat_params`) and the activation parameters of the
+        nodes that are required for the outputs."""
+        flat = self.get_flat_params()
         required_nodes = required_for_output(*get_ids_from_individual(self))
-        
-        # cxs that end at a required node
-        required_cxs = set()
-        for node_id in required_nodes:
-            for cx in self.connection_genome.values():
-                if cx.enabled and cx.key[1] == node_id and cx.key[0] in required_nodes:
-                    required_cxs.add(cx.key)
-        
-        for cx in self.connection_genome.values():
-            if cx.enabled and cx.key in required_cxs:
-                params.append(cx.weight)
-       
+        params = [flat.weights, flat.biases]
         for n in self.node_genome.values():
             if n.key in required_nodes:
-                params.extend(n.params())
-        
+                params.extend(n.activation_params)
         return params
     
     
@@ -283,10 +372,8 @@ class CPPN(nn.Module):
         self.outputs = None # reset output
         
         # make a new computation graph
-        for cx in self.connection_genome.values():
-            if cx.enabled:
-                cx.weight = torch.nn.Parameter(torch.tensor(cx.weight.detach().item(), requires_grad=True, dtype=dtype, device = self.device))
-        # exit()
+        self.flat_params = None
+        self.get_flat_params().requires_grad_(self)
         if create_opt:
             self.optimizer = opt_class(self.get_params(), lr=lr)
             return self.optimizer
@@ -295,8 +382,6 @@ class CPPN(nn.Module):
     
         
     def serialize(self):
-        # del type(self).constant_inputs
-        type(self).constant_inputs = None
         if self.outputs is not None:
             self.outputs = self.outputs.cpu().numpy().tolist() if\
                 isinstance(self.outputs, torch.Tensor) else self.outputs
@@ -444,6 +529,7 @@ class CPPN(nn.Module):
             if torch.rand(1)[0] < prob:
                 node.set_activation(random_choice(config.activations))
         self.outputs = None # reset the image
+        self.invalidate_plan() # activations are part of the structure
 
 
     def mutate_weights(self, prob, config):
@@ -451,30 +537,31 @@ class CPPN(nn.Module):
         Each connection weight is perturbed with a fixed probability by
         adding a floating point number chosen from a uniform distribution of
         positive and negative values """
-        R_delta = torch.rand(len(self.connection_genome.items()), device=self.device)
-        R_reset = torch.rand(len(self.connection_genome.items()), device=self.device)
+        weights = self.get_flat_params().weights
+        R_delta = torch.rand(weights.shape[0], device=self.device)
+        R_reset = torch.rand(weights.shape[0], device=self.device)
+        delta = R_delta < prob
+        reset = ~delta & (R_reset < config.prob_weight_reinit)
 
-        for i, connection in enumerate(self.connection_genome.values()):
-            if R_delta[i] < prob:
-                delta = random_normal(None, 0, config.weight_mutation_std)
-                connection.weight = connection.weight + delta
-            elif R_reset[i] < config.prob_weight_reinit:
-                connection.weight = self.random_weight()
+        # one in-place update of the flat vector, the connections' weights are views
+        with torch.no_grad():
+            noise = torch.randn_like(weights)
+            weights.copy_(torch.where(reset, noise, weights + delta * noise * config.weight_mutation_std))
 
         # self.clamp_weights()
         self.outputs = None # reset the image
 
 
     def mutate_bias(self, prob, config):
-        R_delta = torch.rand(len(self.node_genome.items()), device=self.device)
-        R_reset = torch.rand(len(self.node_genome.items()), device=self.device)
+        biases = self.get_flat_params().biases
+        R_delta = torch.rand(biases.shape[0], device=self.device)
+        R_reset = torch.rand(biases.shape[0], device=self.device)
+        delta = R_delta < prob
+        reset = ~delta & (R_reset < config.prob_weight_reinit)
 
-        for i, node in enumerate(self.node_genome.values()):
-            if R_delta[i] < prob:
-                delta = random_normal(None, 0, config.bias_mutation_std)
-                node.bias = node.bias + delta
-            elif R_reset[i] < config.prob_weight_reinit:
-                node.bias = torch.zeros_like(node.bias)
+        with torch.no_grad():
+            noise = torch.randn_like(biases) * config.bias_mutation_std
+            biases.copy_(torch.where(reset, torch.zeros_like(biases), biases + delta * noise))
 
         self.outputs = None # reset the image
         
@@ -535,12 +622,8 @@ class CPPN(nn.Module):
             self.update_node_layers()
             self.disable_invalid_connections(config)
             
-        self.graph = {}
-            
-            
         self.outputs = None # reset the image
-        if hasattr(self, 'aot_fn'):
-            del self.aot_fn # needs recompile
+        self.invalidate_plan() # also selects a new kernel for act_mode='compiled'
 
     def disable_invalid_connections(self, config):
         """Disables connections that are not compatible with the current configuration."""
@@ -552,6 +635,8 @@ class CPPN(nn.Module):
                     invalid.append(key)
         for key in invalid:
             del self.connection_genome[key]
+        if len(invalid) > 0:
+            self.invalidate_plan()
 
     def add_connection(self, config):
         """Adds a connection to the CPPN."""
@@ -560,8 +645,10 @@ class CPPN(nn.Module):
         for _ in range(20):  # try 20 times max
             [from_node, to_node] = random_choice(list(self.node_genome.values()),
                                                  2, replace=False)
-            if from_node.layer >= to_node.layer:
+            if from_node.layer >= to_node.layer and not config.allow_recurrent:
                 continue  # don't allow recurrent connections
+            if to_node.type == NodeType.INPUT:
+                continue  # inputs only read the input tensor
             # look to see if this connection already exists
             existing_cx = self.connection_genome.get((from_node.id, to_node.id))
 
@@ -570,6 +657,7 @@ class CPPN(nn.Module):
                 if not existing_cx.enabled:
                     if torch.rand(1)[0] < config.prob_reenable_connection:
                         existing_cx.enabled = True # re-enable the connection
+                        self.update_node_layers() # it can close a cycle
                     break  # don't enable more than one connection
                 continue # don't add more than one connection
 
@@ -585,6 +673,7 @@ class CPPN(nn.Module):
 
             # else failed to find a valid connection, don't add and try again
         self.outputs = None # reset the image
+        self.invalidate_plan()
 
     def add_node(self, config):
         """Adds a node to the CPPN.
@@ -628,6 +717,7 @@ class CPPN(nn.Module):
 
         self.update_node_layers() # update the layers of the nodes
         self.outputs = None # reset the image
+        self.invalidate_plan()
         
     def remove_node(self, config):
         """Removes a node from the CPPN.
@@ -652,6 +742,7 @@ class CPPN(nn.Module):
         self.update_node_layers()
         self.disable_invalid_connections(config)
         self.outputs = None # reset the image
+        self.invalidate_plan()
 
     def prune(self, config):
         removed = 0
@@ -678,6 +769,7 @@ class CPPN(nn.Module):
         self.update_node_layers()
         self.disable_invalid_connections(config)
         self.outputs = None # reset the image
+        self.invalidate_plan()
 
     
     def disable_connection(self):
@@ -688,9 +780,11 @@ class CPPN(nn.Module):
         cx = random_choice(eligible_cxs, 1, False)
         cx.enabled = False
         self.outputs = None # reset the image
+        self.invalidate_plan()
 
     def update_node_layers(self):
         """Update the node layers."""
+        self.update_recurrent_connections()
         layers = feed_forward_layers(self)
         max_layer = 0
         for _, node in self.input_nodes().items():
@@ -701,11 +795,18 @@ class CPPN(nn.Module):
                 node.layer = layer_index + 1
             max_layer = max(max_layer, layer_index + 1)
             
-        self.graph = {}
+        self.invalidate_plan()
         # for _, node in self.output_nodes().items():
         #     node.layer = max_layer + 1
          
 
+    def update_recurrent_connections(self):
+        """Marks the enabled connections that close a cycle as recurrent."""
+        inputs, _, connections = get_ids_from_individual(self)
+        recurrent = recurrent_connections(inputs, self.node_genome.keys(), connections)
+        for key, cx in self.connection_genome.items():
+            cx.is_recurrent = cx.enabled and key in recurrent
+
     def get_layer(self, layer_index):
         """Returns a list of nodes in the given layer."""
         for _, node in self.node_genome.items():
@@ -741,8 +842,9 @@ class CPPN(nn.Module):
             node.sum_inputs = None
             node.outputs = None
         
-        for connection in self.connection_genome.values():
-            connection.weight.grad = None
+        if self.flat_params is not None:
+            self.flat_params.weights.grad = None
+            self.flat_params.biases.grad = None
     
     def reset_activations(self, shape):
         """Resets all node activations to zero."""
@@ -751,90 +853,637 @@ class CPPN(nn.Module):
             node.outputs = torch.zeros(shape, device=self.device)
 
  
-    def forward(self, inputs=None, channel_first=True, act_mode='node', use_graph=False):
-        res_h, res_w = inputs.shape[0], inputs.shape[1]
-        node_shape = (res_h, res_w)
+    @contextmanager
+    def inference(self):
+        """Context manager for evaluating the network without autograd.
+
+        Forward passes inside the context run under `torch.inference_mode`:
+        no graph is recorded (including by activations that force gradients
+        such as `sin`), weights and biases are read as detached views and the
+        outputs kept on nodes are inference tensors that reference no
+        parameters.
+        """
+        with torch.inference_mode():
+            yield self
+
+    def invalidate_plan(self):
+        """Discards the cached execution plan. Call after changing the structure."""
+        self.plan = None
+        self.reduced_plan = None
+
+    def get_flat_params(self):
+        """Returns the genome's weights and biases as flat vectors (see
+        `FlatParams`), packing them again if a gene was assigned a new tensor
+        or the structure changed."""
+        flat = getattr(self, 'flat_params', None)
+        if flat is None or not flat.matches(self):
+            flat = self.flat_params = FlatParams(self)
+        return flat
+
+    def get_plan(self):
+        """Returns the execution plan, building it if the structure changed."""
+        if getattr(self, 'plan', None) is None:
+            self.plan = ExecutionPlan(self)
+        elif str(self.plan.device) != str(self.device):
+            self.plan = self.plan.to(self.device)
+        return self.plan
+
+    def get_eval_plan(self, inputs):
+        """Returns the plan to evaluate the network on `inputs` with.
+
+        If `optimize_graph` is enabled and no gradients are needed, this is a
+        reduced plan (see `graph_optimizer.optimize_plan`) that is rebuilt
+        when the weights, biases or constant input channels change. The
+        genome is not modified.
+        """
+        plan = self.get_plan()
+        if not self.optimize_graph:
+            return plan
+        flat = self.get_flat_params()
+        params = plan.gather_biases(flat).view(-1)
+        all_weights = plan.gather_weights(flat)
+        if all_weights is not None:
+            params = torch.cat((params, all_weights))
+        if torch.is_grad_enabled() and params.requires_grad:
+            return plan
+        params = params.detach()
+        constants = constant_channels(inputs)
+        reduced = self.reduced_plan
+        if reduced is None or reduced.base is not plan or not reduced.matches(params, constants):
+            reduced = optimize_plan(self, plan, params, constants)
+            self.reduced_plan = reduced
+        return reduced
+
+    @torch.no_grad()
+    def activate_arena(self, inputs, keep_intermediates=False):
+        """Evaluates the network into a single preallocated node arena.
+
+        Node outputs are written into slots of one (num_slots, H, W) buffer
+        that is reused across calls at the same resolution. Slots are recycled
+        once the last consumer of a node has run (see
+        `ExecutionPlan.allocate_slots`), so only the output nodes are kept
+        unless `keep_intermediates` is True. No autograd graph is recorded.
+
+        Returns the outputs stacked along the first dimension.
+        """
+        plan = self.get_eval_plan(inputs)
+        slots, num_slots = plan.allocate_slots()
+        
+        node_shape = inputs.shape[:2]
+        arena = self.arena
+        if arena is None or arena.shape[0] < num_slots or arena.shape[1:] != node_shape\
+            or arena.dtype != inputs.dtype or arena.device != inputs.device\
+            or arena.is_inference() != torch.is_inference_mode_enabled():
+            arena = torch.empty((num_slots, *node_shape), dtype=inputs.dtype, device=inputs.device)
+            self.arena = arena
+            
+        self.release_activations()
+            
+        flat = self.get_flat_params()
+        all_weights = plan.gather_weights(flat)
+        if all_weights is not None:
+            all_weights = all_weights.to(inputs.dtype)
+        biases = plan.gather_biases(flat).to(inputs.dtype)
+        for pos, node_id in enumerate(plan.node_ids):
+            slot = slots[pos]
+            if slot is None and not keep_intermediates:
+                continue # output never used
+            node = self.node_genome[node_id]
+            if plan.is_input(pos):
+                sum_inputs = inputs[:,:,plan.input_channels[pos]] + biases[pos]
+            elif len(plan.source_positions[pos]) == 0:
+                # all inputs were folded into the bias (see graph_optimizer)
+                sum_inputs = biases[pos].expand(node_shape)
+            else:
+                start, end = plan.weight_slices[pos]
+                X = arena.index_select(0, plan.slot_sources[pos]) # (num_incoming, h, w)
+                sum_inputs = aggregate(X, all_weights[start:end], plan.aggs[pos], dim=0) + biases[pos]
+            output = node.apply_activation(sum_inputs)
+            if slot is not None:
+                arena[slot].copy_(output)
+            if keep_intermediates:
+                node.outputs = output
+        
+        outputs = torch.stack([arena[slots[pos]] if pos is not None else
+                               torch.zeros(node_shape, dtype=inputs.dtype, device=inputs.device)
+                               for pos in plan.output_positions])
+        for node_id, output in zip(plan.output_ids, outputs):
+            self.node_genome[node_id].outputs = output
+        return outputs
+
+    def activate_layers(self, inputs):
+        """Evaluates the network one layer at a time, grouping the nodes of
+        each layer by activation function.
+
+        Each group is evaluated with one gather of its inputs, one batched
+        matrix multiply, bias add and activation call, and one scatter of its
+        outputs, using indices from `ExecutionPlan.gather_groups`.
+
+        Returns the outputs stacked along the first dimension.
+        """
+        plan = self.get_eval_plan(inputs)
+        if plan.agg is None:
+            raise ValueError("Nodes with different aggregation functions cannot be activated by layer. Try `act_mode='node'`.")
+        gather = plan.gather_groups()
+        node_shape = inputs.shape[:2]
+        n_pixels = node_shape[0] * node_shape[1]
+        
+        self.release_activations()
+        
+        flat = self.get_flat_params()
+        all_weights = plan.gather_weights(flat)
+        zero = torch.zeros(1, dtype=inputs.dtype, device=inputs.device)
+        all_weights = torch.cat((all_weights.to(inputs.dtype), zero)) if all_weights is not None else zero
+        biases = plan.gather_biases(flat).to(inputs.dtype)
+        
+        # one row per node plus a row of zeros for padding
+        values = torch.zeros((plan.num_nodes + 1, n_pixels), dtype=inputs.dtype, device=inputs.device)
+        
+        # first layer: inputs
+        channels = [plan.input_channels[pos] for pos in plan.layers[0]]
+        sums = inputs.permute(2, 0, 1)[channels] + biases[:len(channels)].view(-1, 1, 1)
+        for fn, local, positions in plan.activation_groups()[0]:
+            values.index_copy_(0, positions, fn(sums[local]).view(len(local), -1).to(values.dtype))
+        
+        activate = self.layer_activator(inputs)
+        for groups in gather:
+            activate(values, groups, all_weights, biases, plan.agg, node_shape)
+        
+        outputs = torch.stack([values[pos].view(node_shape) if pos is not None else
+                               torch.zeros(node_shape, dtype=inputs.dtype, device=inputs.device)
+                               for pos in plan.output_positions])
+        for node_id, output in zip(plan.output_ids, outputs):
+            self.node_genome[node_id].outputs = output
+        return outputs
+
+    def layer_activator(self, inputs):
+        """Returns the function that activates one layer in `activate_layers`,
+        on the thread pool of `layer_executor` if `layer_threads` is set."""
+        if self.layer_threads > 1 and inputs.device.type == 'cpu':
+            return get_executor(self.layer_threads).activate_layer
+        return activate_layer
+
+    def activate_recurrent(self, inputs, steps=None, tolerance=None):
+        """Evaluates a recurrent network with synchronous update steps.
+
+        Every step evaluates all nodes one layer at a time as in
+        `activate_layers`, except that recurrent connections read the values
+        of the previous step (zeros before the first). Runs `steps` steps
+        (default `recurrent_steps`), or stops once no node value changes by
+        more than `tolerance` (default `recurrent_tolerance`, 0 to disable).
+
+        Returns the outputs stacked along the first dimension.
+        """
+        steps = self.recurrent_steps if steps is None else steps
+        tolerance = self.recurrent_tolerance if tolerance is None else tolerance
+        plan = self.get_plan()
+        if plan.agg is None:
+            raise ValueError("Recurrent nodes with different aggregation functions are not supported.")
+        gather = plan.recurrent_gather_groups()
+        node_shape = inputs.shape[:2]
+        n_pixels = node_shape[0] * node_shape[1]
+        n = plan.num_nodes
+        
+        self.release_activations()
+        
+        flat = self.get_flat_params()
+        all_weights = plan.gather_weights(flat)
+        zero = torch.zeros(1, dtype=inputs.dtype, device=inputs.device)
+        all_weights = torch.cat((all_weights.to(inputs.dtype), zero)) if all_weights is not None else zero
+        biases = plan.gather_biases(flat).to(inputs.dtype)
+        
+        # the current step, the previous step and a row of zeros for padding
+        values = torch.zeros((2 * n + 1, n_pixels), dtype=inputs.dtype, device=inputs.device)
+        
+        # first layer: inputs, the same in every step
+        channels = [plan.input_channels[pos] for pos in plan.layers[0]]
+        sums = inputs.permute(2, 0, 1)[channels] + biases[:len(channels)].view(-1, 1, 1)
+        for fn, local, positions in plan.activation_groups()[0]:
+            values.index_copy_(0, positions, fn(sums[local]).view(len(local), -1).to(values.dtype))
+        
+        activate = self.layer_activator(inputs)
+        for step in range(steps):
+            values[n:2 * n] = values[:n] # the previous step
+            for groups in gather:
+                activate(values, groups, all_weights, biases, plan.agg, node_shape)
+            if tolerance > 0 and (values[:n] - values[n:2 * n]).abs().max() <= tolerance:
+                break
+        
+        outputs = torch.stack([values[pos].view(node_shape) if pos is not None else
+                               torch.zeros(node_shape, dtype=inputs.dtype, device=inputs.device)
+                               for pos in plan.output_positions])
+        for node_id, output in zip(plan.output_ids, outputs):
+            self.node_genome[node_id].outputs = output
+        return outputs
+
+    def needs_grad(self):
+        """Returns True if a forward pass would record gradients of the genome."""
+        if not torch.is_grad_enabled():
+            return False
+        flat = self.get_flat_params()
+        return flat.weights.requires_grad or flat.biases.requires_grad
+
+    @torch.no_grad()
+    def activate_cached(self, inputs):
+        """Evaluates the network node by node, reusing the outputs of nodes
+        whose subgraph is unchanged (see `node_cache.NodeCache`).
+
+        A node's hash covers its activation, aggregation, bias and the hashes
+        and weights of its sources, so after a mutation only the nodes
+        downstream of the change are evaluated. Nodes with module activations
+        (e.g. Conv2d), and everything downstream of them, are not cached.
+
+        Returns the outputs stacked along the first dimension.
+        """
+        plan = self.get_plan()
+        cache = self.node_cache
+        node_shape = inputs.shape[:2]
+        inputs_key = cache.track_inputs(inputs)
+        flat = self.get_flat_params()
+        biases = plan.gather_biases(flat).to(inputs.dtype)
+        all_weights = plan.gather_weights(flat)
+        bias_values = biases.view(-1).tolist()
+        weight_values = all_weights.tolist() if all_weights is not None else []
+        
+        self.release_activations()
+        values, hashes = [], []
+        for pos in range(plan.num_nodes):
+            fn, agg = plan.activations[pos], plan.aggs[pos]
+            sources = plan.source_positions[pos]
+            start, end = plan.weight_slices[pos]
+            name = fn.__name__ if not isinstance(fn, nn.Module) else None
+            if name is None or (plan.is_input(pos) and inputs_key is None) or any(hashes[s] is None for s in sources):
+                key = None
+            elif plan.is_input(pos):
+                key = subgraph_hash(name, inputs_key, plan.input_channels[pos], bias_values[pos])
+            else:
+                key = subgraph_hash(name, agg, bias_values[pos],
+                                    [(hashes[s], weight_values[start + i]) for i, s in enumerate(sources)])
+            output = cache.get(key) if key is not None else None
+            if output is None:
+                node = self.node_genome[plan.node_ids[pos]]
+                if plan.is_input(pos):
+                    X = inputs[:, :, plan.input_channels[pos]]
+                elif len(sources) == 0:
+                    X = torch.zeros(node_shape, dtype=inputs.dtype, device=inputs.device)
+                else:
+                    X = aggregate(torch.stack([values[s] for s in sources], dim=-1),
+                                  all_weights[start:end].to(inputs.dtype), agg)
+                output = node.apply_activation(X + biases[pos])
+                if key is not None:
+                    cache.put(key, output)
+            values.append(output)
+            hashes.append(key)
+        
+        outputs = torch.stack([values[pos] if pos is not None else
+                               torch.zeros(node_shape, dtype=inputs.dtype, device=inputs.device)
+                               for pos in plan.output_positions])
+        for node_id, output in zip(plan.output_ids, outputs):
+            self.node_genome[node_id].outputs = output
+        return outputs
+
+    def activate_sparse(self, inputs):
+        """Evaluates the network one layer at a time with sparse matrix products.
+
+        All node activations are rows of a (num_nodes, H*W) matrix. Each layer
+        is computed with a single `torch.sparse.mm` of a CSR weight matrix
+        (nodes in the layer x previous nodes), followed by one activation call
+        per activation function in the layer. Supports 'sum' and 'mean'
+        aggregation.
+
+        Returns the outputs stacked along the first dimension.
+        """
+        plan = self.get_eval_plan(inputs)
+        csr = plan.layer_csr()
+        groups = plan.activation_groups()
+        node_shape = inputs.shape[:2]
+        n_pixels = node_shape[0] * node_shape[1]
+        
+        self.release_activations()
+        
+        flat = self.get_flat_params()
+        all_weights = plan.gather_weights(flat)
+        biases = plan.gather_biases(flat).to(inputs.dtype)
+        if all_weights is None:
+            # every connection was folded into the biases (see graph_optimizer)
+            all_weights = biases.new_zeros(0)
+        if plan.agg not in ('sum', 'mean'):
+            raise ValueError(f"Unsupported aggregation {plan.agg} for sparse activation. Try `act_mode='node'` for more options.")
+        
+        # writing into one preallocated matrix is faster, but a layer's
+        # product saves its inputs for backward, so rows are concatenated instead
+        needs_grad = torch.is_grad_enabled() and (biases.requires_grad or all_weights.requires_grad)
+        
+        # first layer: inputs
+        channels = [plan.input_channels[pos] for pos in plan.layers[0]]
+        sums = inputs.permute(2, 0, 1)[channels].reshape(len(channels), n_pixels) + biases[:len(channels)]
+        layer_out = self.activate_sparse_groups(sums, groups[0], node_shape)
+        if needs_grad:
+            values = layer_out
+        else:
+            values = torch.empty((plan.num_nodes, n_pixels), dtype=inputs.dtype, device=inputs.device)
+            values[:len(channels)] = layer_out
+        
+        start = len(channels)
+        for layer, layer_groups, (crow, col, w_start, w_end) in zip(plan.layers[1:], groups[1:], csr):
+            end = start + len(layer)
+            W = torch.sparse_csr_tensor(crow, col, all_weights[w_start:w_end].to(inputs.dtype),
+                                        (len(layer), start), check_invariants=False)
+            sums = torch.sparse.mm(W, values[:start])
+            if plan.agg == 'mean':
+                sums = sums / (crow[1:] - crow[:-1]).clamp(min=1).unsqueeze(1)
+            sums = sums + biases[start:end]
+            layer_out = self.activate_sparse_groups(sums, layer_groups, node_shape)
+            if needs_grad:
+                values = torch.cat((values, layer_out))
+            else:
+                values[start:end] = layer_out
+            start = end
+        
+        outputs = torch.stack([values[pos].view(node_shape) if pos is not None else
+                               torch.zeros(node_shape, dtype=inputs.dtype, device=inputs.device)
+                               for pos in plan.output_positions])
+        for node_id, output in zip(plan.output_ids, outputs):
+            self.node_genome[node_id].outputs = output
+        return outputs
+    
+    def activate_sparse_groups(self, sums, groups, node_shape):
+        """Applies the activation functions of one layer to its (n, H*W) sums."""
+        # (n, h, w), Conv2d groups see the image of every node (see GroupedConv2d)
+        sums = sums.view(-1, *node_shape)
+        if len(groups) == 1:
+            return groups[0][0](sums).view(sums.shape[0], -1)
+        out = torch.empty_like(sums)
+        for fn, local, _ in groups:
+            out[local] = fn(sums[local])
+        return out.view(sums.shape[0], -1)
+
+    def activate_compiled(self, inputs, trace=True):
+        """Evaluates the network with a generated straight-line kernel.
+
+        The kernel is generated from the execution plan and shared through a
+        process-wide cache keyed by the structural hash of the genome, so
+        clones and weight-only mutations reuse it. Weights and biases are
+        passed to the kernel as one flat tensor in the genome's dtype, which
+        sums are accumulated in. Input channels are passed in
+        their broadcast shapes (see `codegen.broadcast_channels`), so nodes
+        that only depend on one coordinate cost O(H) or O(W) instead of O(H*W).
+
+        Returns the outputs stacked along the first dimension.
+        """
+        plan = self.get_eval_plan(inputs)
+        if plan.agg is None:
+            raise ValueError("Nodes with different aggregation functions cannot be compiled. Try `act_mode='node'`.")
+        self.release_activations()
+        
+        flat = self.get_flat_params()
+        params = plan.gather_biases(flat).view(-1)
+        all_weights = plan.gather_weights(flat)
+        if all_weights is not None:
+            params = torch.cat((all_weights, params))
+        # y and x are kept as (H, 1) and (1, W) until a node mixes them
+        kernel_inputs = (broadcast_channels(inputs), inputs[:, :, 0])
+        kernel = kernel_cache.get(plan, kernel_inputs, params, trace)
+        outputs = kernel(*kernel_inputs, params)
+        for node_id, output in zip(plan.output_ids, outputs):
+            self.node_genome[node_id].outputs = output
+        return outputs
+
+    def activate(self, inputs, act_mode, keep_intermediates=False):
+        """Evaluates the network with one of the batched activation modes.
+
+        Returns the outputs stacked along the first dimension.
+        """
+        if act_mode == 'layer':
+            return self.activate_layers(inputs)
+        elif act_mode == 'arena':
+            return self.activate_arena(inputs, keep_intermediates)
+        elif act_mode == 'sparse':
+            return self.activate_sparse(inputs)
+        elif act_mode == 'compiled':
+            return self.activate_compiled(inputs)
+        raise ValueError(f"Unknown activation mode {act_mode}")
+
+    def activate_reduced(self, inputs, act_mode, keep_intermediates=False):
+        """Evaluates the network with node values in `compute_dtype`.
+
+        Weights, biases and sums are in `compute_dtype` too (the gathers and
+        matmuls of layer mode run in it), except that compiled kernels add
+        the terms of each sum in the dtype of the genome. The outputs are
+        returned in the dtype of the inputs. If `precision_guard` is set, a
+        fixed random sample of pixels is re-rendered in full precision and
+        the whole image is re-rendered in full precision if the largest error
+        on the sample exceeds `precision_guard`.
+        """
+        plan = self.get_plan()
+        if any(isinstance(fn, nn.Module) for fn in plan.activations) or\
+            (act_mode == 'sparse' and inputs.device.type == 'cpu'):
+            # module weights are in the genome dtype and sparse products
+            # have no reduced precision kernels on the cpu
+            return self.activate(inputs, act_mode, keep_intermediates)
         
-        if str(self.device)!=str(inputs.device):
+        outputs = self.activate(inputs.to(self.compute_dtype), act_mode, keep_intermediates).to(inputs.dtype)
+        if self.precision_guard <= 0:
+            return outputs
+        
+        n_pixels = inputs.shape[0] * inputs.shape[1]
+        n_samples = min(self.precision_guard_samples, n_pixels)
+        generator = torch.Generator().manual_seed(0) # same pixels every time, global RNG untouched
+        sample = torch.randperm(n_pixels, generator=generator)[:n_samples].to(inputs.device)
+        sample_inputs = inputs.reshape(n_pixels, -1).index_select(0, sample).unsqueeze(1) # (n_samples, 1, n_inputs)
+        # the sample has its own arena and leaves the node outputs of the image
+        saved = [(node, node.outputs, node.sum_inputs) for node in self.node_genome.values()]
+        self.arena, arena = self.guard_arena, self.arena
+        try:
+            exact = self.activate(sample_inputs, act_mode).view(outputs.shape[0], n_samples)
+        finally:
+            self.guard_arena, self.arena = self.arena, arena
+            for node, node_outputs, sum_inputs in saved:
+                node.outputs, node.sum_inputs = node_outputs, sum_inputs
+        error = (outputs.view(outputs.shape[0], n_pixels).index_select(1, sample) - exact).abs().max()
+        if not error <= self.precision_guard: # also catches nan
+            logging.info(f"Error of {error.item()} in {self.compute_dtype}, rendering in {inputs.dtype}")
+            outputs = self.activate(inputs, act_mode, keep_intermediates)
+        return outputs
+
+    def release_activations(self):
+        """Releases the outputs that nodes kept from previous forward passes."""
+        for node in self.node_genome.values():
+            node.sum_inputs = None
+            node.outputs = None
+
+    def forward(self, inputs=None, channel_first=True, act_mode='node', keep_intermediates=False):
+        """Evaluates the network on (H, W, n_inputs) inputs, or on a batch of
+        (B, H, W, n_inputs) inputs.
+        
+        Returns (n_outputs, H, W) outputs, or (B, n_outputs, H, W) for a batch
+        (channels last if `channel_first` is False).
+        """
+        if inputs.device != self.device:
             logging.warning(f"Moving CPPN to inputs device: {inputs.device}")
             self.to(inputs.device) # breaks computation graph
+        
+        if inputs.dim() == 4:
+            outputs = self.evaluate_batch(inputs, act_mode, keep_intermediates)
+            if not channel_first:
+                outputs = outputs.permute(0, 2, 3, 1)
+        else:
+            outputs = self.evaluate(inputs, act_mode, keep_intermediates)
+            if not channel_first:
+                outputs = outputs.permute(1, 2, 0)
+        return self.finish_forward(outputs, inputs, channel_first)
+    
+    def evaluate_batch(self, inputs, act_mode='node', keep_intermediates=False):
+        """Returns the (B, n_outputs, H, W) outputs of (B, H, W, n_inputs) inputs.
+        
+        The images are stacked along their rows and evaluated in one pass,
+        unless an activation mixes neighboring pixels (e.g. Conv2d).
+        """
+        b, h, w, c = inputs.shape
+        if any(isinstance(fn, nn.Module) for fn in self.get_plan().activations):
+            return torch.stack([self.evaluate(x, act_mode, keep_intermediates) for x in inputs])
+        outputs = self.evaluate(inputs.reshape(b * h, w, c), act_mode, keep_intermediates)
+        return outputs.view(outputs.shape[0], b, h, w).transpose(0, 1)
+    
+    def choose_act_mode(self, inputs):
+        """Returns the activation mode to use for `act_mode='auto'`.
+
+        The mode is looked up (or measured) once per structure, input shape
+        and gradient mode, see `autotune.AutoTuner`.
+        """
+        key = (self.get_plan(), tuple(inputs.shape), str(inputs.device), inputs.dtype, self.needs_grad())
+        if self.auto_act_mode is None or self.auto_act_mode[0] != key:
+            self.auto_act_mode = (key, get_tuner(self.autotune_path).choose(self, inputs))
+        return self.auto_act_mode[1]
+    
+    def evaluate(self, inputs, act_mode='node', keep_intermediates=False):
+        """Returns the (n_outputs, H, W) outputs of (H, W, n_inputs) inputs,
+        before the post-processing of `finish_forward`."""
+        res_h, res_w = inputs.shape[0], inputs.shape[1]
+        node_shape = (res_h, res_w)
+        
+        if self.get_plan().has_recurrent:
+            return self.activate_recurrent(inputs)
+        
+        if self.node_cache is not None and not self.needs_grad():
+            return self.activate_cached(inputs)
+            
+        if act_mode == 'auto':
+            act_mode = self.choose_act_mode(inputs)
+            
+        if act_mode in ('layer', 'arena', 'sparse', 'compiled'):
+            if self.compute_dtype is not None and self.compute_dtype != inputs.dtype:
+                return self.activate_reduced(inputs, act_mode, keep_intermediates)
+            return self.activate(inputs, act_mode, keep_intermediates)
             
         # reset the activations to 0 before evaluating
         self.reset_activations(node_shape)
         
-        # get layers
-        layers = feed_forward_layers(self) 
-        layers.insert(0, self.input_nodes().keys()) # add input nodes as first layer
+        plan = self.get_plan()
+        flat = self.get_flat_params()
+        all_weights = plan.gather_weights(flat)
+        per_node = self.validation == 'per_node'
 
         # iterate over layers
-        for layer in layers:
-            Xs, Ws, nodes= [], [], []
-            for node_index, node_id in enumerate(layer):
+        for layer in plan.layers:
+            for pos in layer:
                 # iterate over nodes in layer
-                node = self.node_genome[node_id] # the current node
+                node = self.node_genome[plan.node_ids[pos]] # the current node
                 
                 if node.type == NodeType.INPUT:
                     # initialize the node's sum
-                    X = inputs[:,:,node_index].unsqueeze(-1)
+                    X = inputs[:,:,plan.input_channels[pos]].unsqueeze(-1)
                     weights = torch.ones((1), dtype=dtype, device=self.device)
                 else:
-                    # find incoming connections and activate
-                    if use_graph and node_id in self.graph.keys():
-                        required_cxs = self.graph[node_id] # use cached
-                        X, weights = cx_ids_to_inputs(required_cxs, self.node_genome)
-                    else:
-                        required_cxs = collect_connections(self, node_id)
-                        self.graph[node_id] = required_cxs 
-                        
-                    X, weights = cx_ids_to_inputs(required_cxs, self.node_genome)
-                        
-                    # X shape = (num_incoming, res_h, res_w)
-                    if X is None:
-                        X = torch.zeros((res_h, res_w), dtype=dtype, device=self.device)
-                    if weights is None:
-                        weights = torch.ones((1), dtype=dtype, device=self.device)
+                    # gather incoming activations and weights using the plan
+                    X = torch.stack([self.node_genome[plan.node_ids[s]].outputs
+                                     for s in plan.source_positions[pos]], dim=-1)
+                    start, end = plan.weight_slices[pos]
+                    weights = all_weights[start:end]
 
                 if act_mode == 'node':
-                    assert torch.isfinite(X).all()
-                    if not torch.isfinite(weights).all():
-                        # self.draw_nx(show=True)
-                        logging.warning(f"found {torch.tensor(torch.isfinite(weights)==0.0).sum()} non-finite values in node {node.id} weights (out of {weights.numel()}), {weights}")
-                    assert torch.isfinite(weights).all(), f"found {torch.tensor(torch.isfinite(weights)==0.0).sum()} non-finite values in node {node.id} weights (out of {weights.numel()}), {weights}"
-                    # weights[~torch.isfinite(weights)] = torch.nn.Parameter(torch.tensor(0.0, device=self.device, dtype=dtype))
+                    if per_node:
+                        assert torch.isfinite(X).all()
+                        if not torch.isfinite(weights).all():
+                            # self.draw_nx(show=True)
+                            logging.warning(f"found {torch.tensor(torch.isfinite(weights)==0.0).sum()} non-finite values in node {node.id} weights (out of {weights.numel()}), {weights}")
+                        assert torch.isfinite(weights).all(), f"found {torch.tensor(torch.isfinite(weights)==0.0).sum()} non-finite values in node {node.id} weights (out of {weights.numel()}), {weights}"
+                        # weights[~torch.isfinite(weights)] = torch.nn.Parameter(torch.tensor(0.0, device=self.device, dtype=dtype))
                     
                     node.activate(X, weights) # naive
                     
-                    assert torch.isfinite(node.outputs).all(), f"Node {node.id} with activation {node.activation} and inputs {X}, weights {weights} has non-finite output {node.outputs}"
-                elif act_mode == 'layer':
-                    # group by function for efficiency
-                    Xs.append(X)
-                    Ws.append(weights)
-                    nodes.append(node)
+                    if per_node:
+                        assert torch.isfinite(node.outputs).all(), f"Node {node.id} with activation {node.activation} and inputs {X}, weights {weights} has non-finite output {node.outputs}"
                 elif act_mode == 'population':
                     # group by function for efficiency
                     raise RuntimeError("individual forward() called for population activation mode.")
                 else:
                     raise ValueError(f"Unknown activation mode {act_mode}")
-                
-            if act_mode == 'layer':
-                node_agg = nodes[0].agg
-                activate_layer(Xs, Ws, {n.id:n for n in nodes}, node_agg)
             
         # collect outputs from the last layer
         sorted_o = sorted(self.output_nodes().values(), key=lambda x: x.key, reverse=True)
-        outputs = torch.stack([node.outputs for node in sorted_o], dim=0 if channel_first else -1)
-        assert str(outputs.device) == str(self.device), f"Output is on {outputs.device}, should be {self.device}"
+        return torch.stack([node.outputs for node in sorted_o], dim=0)
+    
+    def evaluate_points(self, coords, use_radial_dist=False, use_bias=False, B=None, sin_and_cos=False,
+                        chunk_size=65536, act_mode='layer'):
+        """Evaluates the network at (N, 2) (y, x) coordinates.
+
+        Derived inputs are computed per chunk of `chunk_size` points (see
+        `point_inputs`), so the cost is proportional to N, not to the grid
+        around the points. Returns the (N, n_outputs) outputs, before any
+        image normalization.
+        """
+        if self.output_blur > 0:
+            raise ValueError("Output blur needs neighboring pixels and cannot be applied to points.")
+        outputs = []
+        for start in range(0, coords.shape[0], chunk_size):
+            inputs = CPPN.point_inputs(coords[start:start + chunk_size], use_radial_dist, use_bias,
+                                       self.n_in_nodes, B, sin_and_cos)
+            outputs.append(CPPN.forward(self, inputs, channel_first=False, act_mode=act_mode)[:, 0])
+        if len(outputs) == 0:
+            return torch.zeros((0, self.n_outputs), dtype=coords.dtype, device=coords.device)
+        return torch.cat(outputs, dim=0)
+    
+    def finish_forward(self, outputs, inputs, channel_first=True):
+        """Post-processes the stacked outputs of a forward pass."""
+        if self.validation == 'per_node':
+            assert str(outputs.device) == str(self.device), f"Output is on {outputs.device}, should be {self.device}"
 
         self.outputs = outputs
                 
         if self.output_blur > 0:
-            self.outputs = gaussian_blur(self.outputs, self.output_blur)
-                
-        assert str(self.outputs.device )== str(self.device), f"Output is on {self.outputs.device}, should be {self.device}"
-        assert self.outputs.dtype == torch.float32, f"Output is {self.outputs.dtype}, should be float32"
+            # blurs rows and columns of (C, H, W) or (B, C, H, W) outputs
+            if channel_first:
+                self.outputs = gaussian_blur(self.outputs, self.output_blur)
+            else:
+                self.outputs = gaussian_blur(self.outputs.movedim(-1, -3), self.output_blur).movedim(-3, -1)
+        
+        if self.validation == 'per_node':
+            assert str(self.outputs.device )== str(self.device), f"Output is on {self.outputs.device}, should be {self.device}"
+            assert self.outputs.dtype == torch.float32, f"Output is {self.outputs.dtype}, should be float32"
+        if self.validation != 'off' and not torch.isfinite(self.outputs).all():
+            # one fused check, the offending nodes are only located on failure
+            raise RuntimeError(f"Output has non-finite values, first produced by nodes {self.find_non_finite_nodes(inputs)}")
     
         return self.outputs
     
+    @torch.no_grad()
+    def find_non_finite_nodes(self, inputs):
+        """Returns the ids of the nodes with non-finite outputs whose inputs are
+        all finite, i.e. where non-finite values first appear.
+
+        Re-evaluates the network node by node, so only call this on failure.
+        """
+        plan = self.get_plan()
+        validation, self.validation = self.validation, 'off'
+        try:
+            CPPN.forward(self, inputs, act_mode='node')
+        finally:
+            self.validation = validation
+        finite = [bool(torch.isfinite(self.node_genome[i].outputs).all()) for i in plan.node_ids]
+        return [node_id for pos, node_id in enumerate(plan.node_ids)
+                if not finite[pos] and all(finite[s] for s in plan.source_positions[pos])]
+    
 
     def backward(self, loss:torch.Tensor,retain_graph=False):
         """Backpropagates the error through the network."""
@@ -914,6 +1563,7 @@ class CPPN(nn.Module):
 
         child.parents = (parent1.id, parent2.id)
         child.update_node_layers()
+        child.invalidate_plan()
         
         return child
 
@@ -955,7 +1605,9 @@ class CPPN(nn.Module):
         
         child.set_id(id)
         child.age = 0
-        child.graph = {}
+        child.plan = self.plan # same structure, plans are never modified in-place
+        child.reduced_plan = self.reduced_plan
+        child.node_cache = self.node_cache # offspring reuse the outputs of unchanged nodes
         
         if cpu:
             child.to('cpu')
@@ -967,8 +1619,7 @@ class CPPN(nn.Module):
     
     def to(self, device):
         """Moves the CPPN to the given device (in-place)."""
-        if isinstance(device, str):
-            device = torch.device(device)
+        device = as_device(device)
         # if self.device == device:
             # return
         self.device = device
@@ -0,0 +1,330 @@
+"""Contains the ExecutionPlan, a cached description of how to evaluate a CPPN."""
+import torch
+
+from cppn_torch.gene import NodeType
+from cppn_torch.graph_util import feed_forward_layers, GroupedConv2d
+
+
+def can_group_conv(fn):
+    """Returns True for (1 -> 1 channel) Conv2d activations."""
+    return isinstance(fn, torch.nn.Conv2d) and fn.in_channels == 1 and fn.out_channels == 1
+
+
+class ExecutionPlan:
+    """A compiled, structure-only description of a CPPN forward pass.
+
+    Holds the topological order of the nodes that are evaluated, the source
+    indices of every node and the order in which connection weights are
+    gathered. Weights and biases are read from the genome's flat vectors (see
+    `flat_params.FlatParams`) at evaluation time, so the plan only needs to
+    be rebuilt when the structure of the genome changes (see
+    `CPPN.invalidate_plan`).
+
+    Index tensors are never inference tensors, so a plan built inside
+    `CPPN.inference` can be reused by forward passes that need gradients.
+    """
+
+    @torch.inference_mode(False)
+    def __init__(self, cppn, layers=None, incoming=None):
+        """Builds the plan of a CPPN.
+
+        `layers` (hidden and output node ids per layer) and `incoming` (node
+        id -> incoming connection keys) default to the feed-forward layers and
+        enabled connections of the genome (see `graph_optimizer`).
+        """
+        self.device = cppn.device
+
+        if incoming is None:
+            # incoming enabled connections of every node
+            incoming = {}
+            for cx in cppn.connection_genome.values():
+                if cx.enabled:
+                    incoming.setdefault(cx.key[1], []).append(cx.key)
+
+        if layers is None:
+            layers = feed_forward_layers(cppn)
+        layers = [sorted(layer) for layer in layers]
+        layers.insert(0, list(cppn.input_nodes().keys())) # add input nodes as first layer
+
+        self.node_ids = []          # topological order, inputs first
+        self.index = {}             # node id -> position in node_ids
+        self.layers = []            # positions in node_ids, one list per layer
+        self.input_channels = {}    # position -> channel of the inputs tensor
+        self.source_positions = []  # position -> tuple of source positions
+        self.weight_slices = []     # position -> (start, end) in cx_keys
+        self.cx_keys = []           # order in which weights are gathered
+
+        for layer in layers:
+            positions = []
+            for node_id in layer:
+                positions.append(len(self.node_ids))
+                self.index[node_id] = len(self.node_ids)
+                self.node_ids.append(node_id)
+            self.layers.append(positions)
+
+        for pos, node_id in enumerate(self.node_ids):
+            if pos < len(self.layers[0]):
+                # NOTE: channel is the order of the input nodes in the genome
+                self.input_channels[pos] = len(self.input_channels)
+                self.source_positions.append(())
+                self.weight_slices.append((0, 0))
+                continue
+            # sorted by source position (column order of the layer's CSR matrix),
+            # recurrent connections from nodes that are never evaluated read zeros
+            keys = sorted((k for k in incoming.get(node_id, []) if k[0] in self.index), key=lambda k: self.index[k[0]])
+            start = len(self.cx_keys)
+            self.cx_keys.extend(keys)
+            self.source_positions.append(tuple(self.index[k[0]] for k in keys))
+            self.weight_slices.append((start, len(self.cx_keys)))
+        
+        # recurrent connections read a node that is evaluated later (or the
+        # node itself), i.e. its value from the previous step
+        self.recurrent = [self.index[k[0]] >= self.index[k[1]] for k in self.cx_keys]
+        self.has_recurrent = any(self.recurrent)
+
+        self.node_types = [cppn.node_genome[i].type for i in self.node_ids]
+        # activation functions are part of the structure (see CPPN.mutate_activations)
+        self.activations = [cppn.node_genome[i].activation for i in self.node_ids]
+        self.aggs = [cppn.node_genome[i].agg for i in self.node_ids]
+        # aggregation of the non-input nodes, None if they differ
+        aggs = set(self.aggs[pos] for layer in self.layers[1:] for pos in layer)
+        self.agg = aggs.pop() if len(aggs) == 1 else (None if len(aggs) > 1 else 'sum')
+        self.structure_hash = None # see codegen.structural_hash
+
+        # outputs are stacked in descending key order
+        self.output_ids = sorted(cppn.output_nodes().keys(), reverse=True)
+        # outputs that are never reached are None (they evaluate to zeros)
+        self.output_positions = [self.index.get(i) for i in self.output_ids]
+
+        self.sources = [torch.tensor(s, dtype=torch.long, device=self.device)
+                        if len(s) > 0 else None for s in self.source_positions]
+
+        # arena slot assignment, computed on first use (see allocate_slots)
+        self.slots = None
+        self.num_slots = 0
+        self.slot_sources = None
+        
+        # per-layer sparse weight layout, computed on first use (see layer_csr)
+        self.csr = None
+        self.groups = None
+        self.gather = None
+        self.recurrent_gather = None
+
+    @property
+    def num_nodes(self):
+        """The number of nodes that are evaluated."""
+        return len(self.node_ids)
+
+    def is_input(self, pos):
+        return self.node_types[pos] == NodeType.INPUT
+
+    def used_input_channels(self):
+        """Returns the sorted channels of the inputs that affect the outputs."""
+        used = set(s for sources in self.source_positions for s in sources)
+        used.update(pos for pos in self.output_positions if pos is not None)
+        return sorted(self.input_channels[pos] for pos in used if self.is_input(pos))
+
+    def dependent_positions(self, channels):
+        """Returns the set of positions whose values depend on the given input channels."""
+        channels = set(channels)
+        dependent = set()
+        for pos in range(self.num_nodes):
+            if self.is_input(pos):
+                if self.input_channels[pos] in channels:
+                    dependent.add(pos)
+            elif any(s in dependent for s in self.source_positions[pos]):
+                dependent.add(pos)
+        return dependent
+
+    def gather_biases(self, params):
+        """Returns the biases of the plan's nodes as a (num_nodes, 1) tensor,
+        read from the genome's `FlatParams`."""
+        return params.biases[params.index(self)[1]].view(-1, 1)
+
+    def gather_weights(self, params):
+        """Returns the weights of the plan's connections as a single tensor,
+        read from the genome's `FlatParams`."""
+        if len(self.cx_keys) == 0:
+            return None
+        return params.weights[params.index(self)[0]]
+
+    @torch.inference_mode(False)
+    def allocate_slots(self):
+        """Assigns every node whose output is needed a slot in a node arena.
+
+        Liveness analysis over the topological order: a slot is recycled as
+        soon as the last consumer of the node that occupies it has run, and
+        outputs stay live until the end. Nodes whose output is never used
+        (e.g. unconnected inputs) get no slot.
+
+        Returns (slots, num_slots) where slots[pos] is the slot of node `pos`
+        or None.
+        """
+        if self.slots is not None:
+            return self.slots, self.num_slots
+
+        n = self.num_nodes
+        last_use = [-1] * n
+        for pos, sources in enumerate(self.source_positions):
+            for s in sources:
+                last_use[s] = max(last_use[s], pos)
+        for pos in self.output_positions:
+            if pos is not None:
+                last_use[pos] = n # live until the end
+
+        slots = [None] * n
+        free = []
+        num_slots = 0
+        # positions are in evaluation order
+        for pos in range(n):
+            # the sources are gathered before the output is written, so their
+            # slots can be reused by this node
+            for s in set(self.source_positions[pos]):
+                if last_use[s] == pos:
+                    free.append(slots[s])
+            if last_use[pos] < 0:
+                continue # output never used
+            if len(free) > 0:
+                slots[pos] = free.pop()
+            else:
+                slots[pos] = num_slots
+                num_slots += 1
+
+        self.slots = slots
+        self.num_slots = num_slots
+        self.slot_sources = [torch.tensor([slots[s] for s in sources], dtype=torch.long, device=self.device)
+                             if len(sources) > 0 else None for sources in self.source_positions]
+        return self.slots, self.num_slots
+
+    @torch.inference_mode(False)
+    def activation_groups(self):
+        """Groups the nodes of each layer by activation function.
+
+        Returns a list with one entry per layer, each a list of
+        (activation, local indices, positions) where local indices are the
+        indices of the nodes within the layer. Every node has its own Conv2d
+        activation, compatible ones are grouped into one `GroupedConv2d`.
+        """
+        if self.groups is not None:
+            return self.groups
+        self.groups = []
+        for layer in self.layers:
+            by_fn = {}
+            for i, pos in enumerate(layer):
+                fn = self.activations[pos]
+                key = GroupedConv2d.key(fn) if can_group_conv(fn) else fn
+                by_fn.setdefault(key, []).append(i)
+            groups = []
+            for key, local in by_fn.items():
+                positions = [layer[i] for i in local]
+                fn = self.activations[positions[0]]
+                if can_group_conv(fn):
+                    fn = GroupedConv2d([self.activations[pos] for pos in positions])
+                groups.append((fn,
+                               torch.tensor(local, dtype=torch.long, device=self.device),
+                               torch.tensor(positions, dtype=torch.long, device=self.device)))
+            self.groups.append(groups)
+        return self.groups
+
+    @torch.inference_mode(False)
+    def gather_groups(self):
+        """Returns padded gather indices for every activation group of every
+        layer after the inputs.
+
+        Each entry is a list of (activation, positions, sources, weight_index,
+        mask, counts) per activation group, where sources and weight_index are
+        (n_nodes, max_in) matrices of source positions and indices into the
+        gathered weights. Padding points at row `num_nodes` of the node
+        values (kept at zero) and at weight `len(cx_keys)` (also zero), so
+        padded entries do not contribute to a sum. mask is False at padded
+        entries and counts holds the number of incoming connections. Nodes
+        whose connections were all folded into their bias (see
+        graph_optimizer) have a count of 0, and a group of only such nodes
+        has max_in == 0 (see `graph_util.activate_group`).
+        """
+        if self.gather is None:
+            self.gather = self.build_gather_groups(recurrent=False)
+        return self.gather
+
+    @torch.inference_mode(False)
+    def recurrent_gather_groups(self):
+        """Returns `gather_groups` for node values holding the current step in
+        rows [0, num_nodes) and the previous step in rows [num_nodes, 2 * num_nodes).
+
+        Recurrent connections read the previous step and padding points at
+        row 2 * num_nodes (see `CPPN.activate_recurrent`).
+        """
+        if self.recurrent_gather is None:
+            self.recurrent_gather = self.build_gather_groups(recurrent=True)
+        return self.recurrent_gather
+
+    def build_gather_groups(self, recurrent):
+        pad_source = 2 * self.num_nodes if recurrent else self.num_nodes
+        pad_weight = len(self.cx_keys)
+        gather = []
+        for layer_groups in self.activation_groups()[1:]:
+            groups = []
+            for fn, _, positions in layer_groups:
+                positions_list = positions.tolist()
+                max_in = max(len(self.source_positions[pos]) for pos in positions_list)
+                sources, weight_index, counts = [], [], []
+                for pos in positions_list:
+                    n_in = len(self.source_positions[pos])
+                    start, end = self.weight_slices[pos]
+                    node_sources = list(self.source_positions[pos])
+                    if recurrent:
+                        node_sources = [s + self.num_nodes if self.recurrent[start + i] else s
+                                        for i, s in enumerate(node_sources)]
+                    sources.append(node_sources + [pad_source] * (max_in - n_in))
+                    weight_index.append(list(range(start, end)) + [pad_weight] * (max_in - n_in))
+                    counts.append(n_in)
+                sources = torch.tensor(sources, dtype=torch.long, device=self.device)
+                groups.append((fn, positions, sources,
+                               torch.tensor(weight_index, dtype=torch.long, device=self.device),
+                               sources != pad_source,
+                               torch.tensor(counts, device=self.device).view(-1, 1)))
+            gather.append(groups)
+        return gather
+
+    @torch.inference_mode(False)
+    def layer_csr(self):
+        """Returns the sparse weight layout of every layer after the inputs.
+
+        Each entry is (crow_indices, col_indices, weight_start, weight_end):
+        the rows of the layer's CSR matrix are the nodes of the layer, the
+        columns are the positions of all previously evaluated nodes and the
+        values are `weights[weight_start:weight_end]`, since the weights of a
+        layer are contiguous in `cx_keys`.
+        """
+        if self.csr is not None:
+            return self.csr
+        self.csr = []
+        for layer in self.layers[1:]:
+            w_start = self.weight_slices[layer[0]][0]
+            w_end = self.weight_slices[layer[-1]][1]
+            crow = [0]
+            col = []
+            for pos in layer:
+                col.extend(self.source_positions[pos])
+                crow.append(len(col))
+            self.csr.append((torch.tensor(crow, dtype=torch.long, device=self.device),
+                             torch.tensor(col, dtype=torch.long, device=self.device),
+                             w_start, w_end))
+        return self.csr
+
+    @torch.inference_mode(False)
+    def to(self, device):
+        """Returns a plan with its index tensors on the given device."""
+        if str(device) == str(self.device):
+            return self
+        plan = object.__new__(type(self))
+        plan.__dict__.update(self.__dict__)
+        plan.device = device
+        plan.sources = [s.to(device) if s is not None else None for s in self.sources]
+        # recomputed on the new device
+        plan.slots = None
+        plan.csr = None
+        plan.groups = None
+        plan.gather = None
+        plan.recurrent_gather = None
+        return plan
@@ -0,0 +1,87 @@
+"""Keeps the weights and biases of a genome in two contiguous vectors."""
+import torch
+
+
+def as_index(indices, device):
+    """Returns `indices` as a slice if they are contiguous, else as a tensor."""
+    if len(indices) == 0 or indices == list(range(indices[0], indices[0] + len(indices))):
+        start = indices[0] if len(indices) > 0 else 0
+        return slice(start, start + len(indices))
+    return torch.tensor(indices, dtype=torch.long, device=device)
+
+
+class FlatParams:
+    """The weights and biases of a genome as two flat vectors, in genome order.
+
+    Every connection's `weight` is a 0-d view into `weights` and every node's
+    `bias` a (1,) view into `biases`, so in-place updates of the vectors (e.g.
+    `CPPN.mutate_weights` or an optimizer step) change the genome without
+    any per-gene work, and `ExecutionPlan.gather_weights` reads the plan's
+    weights from the vector with one index. Assigning a new tensor to a
+    gene's `weight` or `bias` unpacks it and invalidates the vectors, which
+    are then rebuilt by `CPPN.get_flat_params`.
+    """
+
+    @torch.inference_mode(False)
+    def __init__(self, cppn):
+        cxs = list(cppn.connection_genome.values())
+        nodes = list(cppn.node_genome.values())
+        self.device = cppn.device
+        self.cx_index = {cx.key: i for i, cx in enumerate(cxs)}
+        self.node_index = {node.id: i for i, node in enumerate(nodes)}
+        biases = torch.cat([node.bias.view(1) for node in nodes])
+        weights = torch.stack([cx.weight for cx in cxs]) if len(cxs) > 0 else biases[:0]
+        self.weights = weights.detach().clone().to(cppn.device).requires_grad_(weights.requires_grad)
+        self.biases = biases.detach().clone().to(cppn.device).requires_grad_(biases.requires_grad)
+        self.valid = True
+        self.checked_plan = None # see matches
+        self.plan = None         # see index
+        self.bind(cxs, nodes)
+
+    @torch.inference_mode(False)
+    def bind(self, cxs, nodes):
+        """Makes the genes' weights and biases views into the vectors."""
+        for cx, i in zip(cxs, self.cx_index.values()):
+            cx.__dict__['weight'] = self.weights[i]
+            cx.__dict__['_flat'] = self
+        for node, i in zip(nodes, self.node_index.values()):
+            node.__dict__['bias'] = self.biases[i:i + 1]
+            node.__dict__['_flat'] = self
+
+    def requires_grad_(self, cppn, requires_grad=True):
+        """Sets `requires_grad` of the vectors and of the genes' views."""
+        self.weights.requires_grad_(requires_grad)
+        self.biases.requires_grad_(requires_grad)
+        self.bind(list(cppn.connection_genome.values()), list(cppn.node_genome.values()))
+
+    def matches(self, cppn):
+        """Returns True if every gene of the genome is still a view into the vectors."""
+        if not self.valid or str(self.device) != str(cppn.device):
+            return False
+        if len(self.cx_index) != len(cppn.connection_genome) or len(self.node_index) != len(cppn.node_genome):
+            return False
+        plan = getattr(cppn, 'plan', None)
+        if plan is None or plan is not self.checked_plan:
+            # genes are only added or replaced with a structural change
+            genes = list(cppn.connection_genome.values()) + list(cppn.node_genome.values())
+            if any(gene.__dict__.get('_flat') is not self for gene in genes):
+                return False
+            self.checked_plan = plan
+        return True
+
+    @torch.inference_mode(False)
+    def index(self, plan):
+        """Returns the indices of the plan's weights and biases in the vectors."""
+        if plan is not self.plan:
+            self.weight_index = as_index([self.cx_index[k] for k in plan.cx_keys], self.device)
+            self.bias_index = as_index([self.node_index[i] for i in plan.node_ids], self.device)
+            self.plan = plan
+        return self.weight_index, self.bias_index
+
+    def __getstate__(self):
+        # copies of a genome repack from their own genes (see Gene.__getstate__)
+        return {"valid": False, "device": self.device}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.plan = self.checked_plan = None
@@ -7,22 +7,10 @@ def apply_mapping(x, B:torch.tensor, sin_and_cos=False):
     if B is None:
       return x
     else:
-      device = x.device
-      x = x.cpu().numpy()
-      B = B.cpu().numpy()
-      x_proj = (2.*np.pi*x) @ B.T
+      x_proj = (2.*np.pi*x) @ B.to(x).T
       if sin_and_cos:
-        result = np.concatenate([np.sin(x_proj), np.cos(x_proj)], axis=-1)
-      else:
-        result = np.sin(x_proj)
-      return torch.tensor(result, device=device).float()
-
-    
-    # x_proj = (2.*torch.pi*x) @ B.T
-    # f0 = torch.sin(x_proj)
-    # # return torch.cat([f0], dim=-1)
-    # f1 = torch.cos(x_proj)
-    # return torch.cat([f0,f1], dim=-1)
+        return torch.cat([torch.sin(x_proj), torch.cos(x_proj)], dim=-1)
+      return torch.sin(x_proj)
 
 def input_mapping(x, b_scale:float, mapping_size:int, dims:int=2, sin_and_cos=False):
     mapping_size = mapping_size // 2 if sin_and_cos else mapping_size
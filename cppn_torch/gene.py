@@ -5,7 +5,7 @@ import torch
 from copy import deepcopy
 from cppn_torch.activation_functions import identity
 
-from cppn_torch.graph_util import name_to_fn
+from cppn_torch.graph_util import name_to_fn, aggregate
 
 class NodeType(IntEnum):
     """Enum for the type of node."""
@@ -15,11 +15,38 @@ class NodeType(IntEnum):
 
 class Gene(object):
     """Represents either a node or connection in the CPPN"""
+    _packed_attribute = None # kept in the genome's FlatParams
+    
     def __init__(self, key=None) -> None:
         pass
+    
+    def __setattr__(self, name, value):
+        if name == self._packed_attribute and value is not self.__dict__.get(name):
+            # no longer a view into the genome's flat vectors
+            flat = self.__dict__.pop('_flat', None)
+            if flat is not None:
+                flat.valid = False
+        object.__setattr__(self, name, value)
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if state.pop('_flat', None) is not None:
+            # copy the value out of the flat vector instead of the whole vector
+            state[self._packed_attribute] = self.gene_value(self._packed_attribute)
+        return state
+    
+    def gene_value(self, name):
+        """Returns the value of an attribute for a new gene, the packed value
+        is copied so that it does not change with this genome."""
+        value = getattr(self, name)
+        if name == self._packed_attribute and '_flat' in self.__dict__:
+            value = value.detach().clone().requires_grad_(value.requires_grad)
+        return value
+    
     def copy(self,deep=False):
         new_gene = self.__class__(key=self.key)
-        for name, value in self._gene_attributes:
+        for name, _ in self._gene_attributes:
+            value = self.gene_value(name)
             if deep:
                 setattr(new_gene, name, deepcopy(value))
             else:
@@ -45,16 +72,17 @@ class Gene(object):
         # assert isinstance(self.key, tuple), f"Cannot crossover genes with non-tuple keys, has type {type(self.key)} key: {self.key}"
         new_gene = self.__class__(self.key)
 
-        for name, value in self._gene_attributes:
+        for name, _ in self._gene_attributes:
             if torch.rand(1)[0] < 0.5:
-                setattr(new_gene, name, value)
+                setattr(new_gene, name, self.gene_value(name))
             else:
-                setattr(new_gene, name, getattr(other, name))
+                setattr(new_gene, name, other.gene_value(name))
 
         return new_gene
     
 class Node(Gene):
     """Represents a node in the CPPN."""
+    _packed_attribute = 'bias'
     # TODO: aggregation function, response(?)
     
     @staticmethod
@@ -116,33 +144,14 @@ class Node(Gene):
         
         # X_shape = (h,w,c)
         # W_shape = (c)
-        
-        if self.agg == 'sum':
-            self.sum_inputs =torch.matmul(X, W) # (h,w,c) * (c) = (h,w)
-            self.sum_inputs += self.bias
-            
-        else:
-            X_shape = X.shape[1:]
-            X = X.reshape(X.shape[0], -1)
-            W = W.unsqueeze(1) # reshape for broadcasting
-            weighted_x = torch.mul(W, X)
-            
-            if self.agg == 'mean':
-                self.sum_inputs = weighted_x.mean(dim=0)
-            elif self.agg == 'max':
-                self.sum_inputs = weighted_x.max(dim=0)[0]
-            elif self.agg == 'min':
-                self.sum_inputs = weighted_x.min(dim=0)[0] 
-            else:
-                raise ValueError(f"Unknown aggregation function {self.agg}")
-            
-            self.sum_inputs = self.sum_inputs.reshape(X_shape) # reshape back to original shape
-        
-        self.sum_inputs += self.bias
+        self.sum_inputs = aggregate(X, W, self.agg) + self.bias
+        self.outputs = self.apply_activation(self.sum_inputs)
+
+    def apply_activation(self, X):
+        """Applies the node's activation function to its aggregated inputs."""
         if not isinstance(self.activation, torch.nn.Conv2d):
-            self.outputs = self.activation(self.sum_inputs)  # apply activation
-        else:
-            self.outputs = self.activation(self.sum_inputs.unsqueeze(0)).squeeze(0)
+            return self.activation(X)
+        return self.activation(X.unsqueeze(0)).squeeze(0)
 
     def initialize_sum(self, initial_sum):
         """Activates the node."""
@@ -204,6 +213,8 @@ class Connection(Gene):
     where innovation number is the same for all of same connection
     i.e. 2->5 and 2->5 have same innovation number, regardless of individual
     """
+    _packed_attribute = 'weight'
+
     def __init__(self, key, weight = None, enabled = True) -> None:
         # Initialize
         self.key_ = key
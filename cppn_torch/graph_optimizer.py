@@ -0,0 +1,146 @@
+"""Reduces the evaluation graph of a CPPN without changing its genome."""
+import torch
+
+import cppn_torch.activation_functions as af
+from cppn_torch.execution_plan import ExecutionPlan
+from cppn_torch.graph_util import aggregate
+from cppn_torch.node_cache import cached_per_inputs
+
+
+class ReducedPlan(ExecutionPlan):
+    """An execution plan of a reduced graph.
+
+    Folding rewrites weights and biases, so they are baked into the plan
+    instead of being read from the genome. The plan is only valid for the
+    parameters and constant input channels it was built from (see
+    `matches`) and is not differentiable.
+    """
+
+    def __init__(self, cppn, base, layers, incoming, biases, params, constants):
+        super().__init__(cppn, layers, {i: [(s, i) for s in w] for i, w in incoming.items()})
+        self.base = base # the plan of the genome this plan was reduced from
+        self.params = params
+        self.constants = constants
+        weights = [incoming[key[1]][key[0]] for key in self.cx_keys]
+        self.weights = torch.stack(weights) if len(weights) > 0 else None
+        self.biases = torch.stack([biases[i] for i in self.node_ids]).view(-1, 1)
+
+    def matches(self, params, constants):
+        """Returns True if the plan was built from the given parameters."""
+        return self.constants == constants and torch.equal(self.params, params)
+
+    def gather_biases(self, params):
+        return self.biases
+
+    def gather_weights(self, params):
+        return self.weights
+
+    def to(self, device):
+        plan = super().to(device)
+        if plan is not self:
+            plan.weights = self.weights.to(device) if self.weights is not None else None
+            plan.biases = self.biases.to(device)
+        return plan
+
+
+@cached_per_inputs()
+def constant_channels(inputs):
+    """Returns {channel: value} for the channels of `inputs` that are constant.
+
+    Channels are checked with one transfer and cached per inputs tensor.
+    """
+    low, high = inputs.reshape(-1, inputs.shape[-1]).aminmax(dim=0)
+    values, constant = torch.stack((low, (low == high).to(low.dtype))).tolist()
+    return {c: v for c, (v, is_constant) in enumerate(zip(values, constant)) if is_constant}
+
+
+def can_fold(fn):
+    """Module activations (e.g. Conv2d) depend on neighbouring pixels."""
+    return not isinstance(fn, torch.nn.Module)
+
+
+def optimize_plan(cppn, plan, params, constants):
+    """Returns a `ReducedPlan` that evaluates to the same outputs as `plan`.
+
+    params: The plan's biases followed by its weights (see `CPPN.get_eval_plan`).
+    constants: {channel: value} of the input channels that are constant.
+
+    The genome is not modified. Passes, in one sweep in topological order:
+        - nodes whose inputs are all constant are folded into scalars, which
+          'sum' nodes add to their bias
+        - single-input `identity` hidden nodes are folded into the weights of
+          their outgoing connections (and their bias into the consumer's bias)
+        - parallel connections created by folding are merged
+        - zero-weight connections into 'sum' nodes are dropped
+        - nodes that no longer feed an output are eliminated
+    """
+    params = params.detach()
+    biases = dict(zip(plan.node_ids, params[:plan.num_nodes].unbind(0)))
+    weights = params[plan.num_nodes:].unbind(0)
+
+    output_ids = set(plan.output_ids)
+    incoming = {}  # node id -> {source id: weight}
+    values = {}    # node id -> value of constant nodes
+    aliases = {}   # folded identity node id -> (source id, weight, bias)
+    for pos, node_id in enumerate(plan.node_ids):
+        fn, agg = plan.activations[pos], plan.aggs[pos]
+        if plan.is_input(pos):
+            channel = plan.input_channels[pos]
+            if channel in constants and can_fold(fn):
+                values[node_id] = fn(torch.tensor(constants[channel], dtype=params.dtype) + biases[node_id])
+            continue
+
+        bias = biases[node_id]
+        edges = {}
+        start, _ = plan.weight_slices[pos]
+        sources = [plan.node_ids[s] for s in plan.source_positions[pos]]
+        for i, source in enumerate(sources):
+            w = weights[start + i]
+            if source in aliases:
+                a, w_a, b = aliases[source]
+                # parallel connections and biases only merge under 'sum'
+                if agg == 'sum' or (b == 0 and a not in sources and a not in edges):
+                    # w * (w_a * x_a + b) = (w * w_a) * x_a + w * b
+                    source, w, bias = a, w * w_a, bias + w * b
+            if agg == 'sum' and source in values:
+                bias = bias + w * values[source]
+            elif source in edges:
+                edges[source] = edges[source] + w
+            else:
+                edges[source] = w
+        if agg == 'sum':
+            edges = {s: w for s, w in edges.items() if w != 0}
+        biases[node_id] = bias
+        incoming[node_id] = edges
+
+        if not can_fold(fn) or node_id in output_ids:
+            continue
+        if all(s in values for s in edges):
+            X = torch.stack([values[s] for s in edges]) if len(edges) > 0 else torch.zeros(0, dtype=params.dtype)
+            W = torch.stack(list(edges.values())) if len(edges) > 0 else torch.zeros(0, dtype=params.dtype)
+            values[node_id] = fn(aggregate(X, W, agg) + bias)
+        elif fn is af.identity and len(edges) == 1:
+            (source, w), = edges.items()
+            aliases[node_id] = (source, w, bias)
+
+    # eliminate nodes that no longer feed an output
+    live = set(i for i in output_ids if i in plan.index)
+    for node_id in reversed(plan.node_ids):
+        if node_id in live:
+            live.update(incoming.get(node_id, {}).keys())
+    incoming = {i: edges for i, edges in incoming.items() if i in live}
+
+    # re-layer the remaining nodes by depth
+    depth = {i: 0 for i in plan.node_ids[:len(plan.layers[0])]}
+    layers = []
+    for node_id in plan.node_ids[len(plan.layers[0]):]:
+        if node_id not in live:
+            continue
+        d = 1 + max((depth[s] for s in incoming[node_id]), default=0)
+        depth[node_id] = d
+        while len(layers) < d:
+            layers.append([])
+        layers[d - 1].append(node_id)
+
+    incoming = {i: {s: edges[s] for s in sorted(edges)} for i, edges in incoming.items()}
+    return ReducedPlan(cppn, plan, layers, incoming, biases, params, constants)
@@ -183,6 +183,32 @@ def get_incoming_connections_weights(individual, node_id):
 
     return inputs, weights
 
+def aggregate(X, W, agg, dim=-1):
+    """Aggregates the inputs X, weighted by W, along the incoming dimension `dim`.
+    params:
+        X: The inputs, with shape (..., num_incoming) or (num_incoming, ...).
+        W: The weights, with shape (num_incoming).
+        agg: The aggregation function, one of 'sum', 'mean', 'max' or 'min'.
+        dim: The incoming dimension of X, either -1 or 0.
+    returns:
+        The aggregated inputs with the incoming dimension removed.
+    """
+    if agg == 'sum':
+        if dim == 0:
+            return torch.tensordot(W, X, dims=1) # (c) * (c,h,w) = (h,w)
+        return torch.matmul(X, W) # (h,w,c) * (c) = (h,w)
+    
+    if dim == 0:
+        W = W.view(-1, *([1] * (X.dim() - 1))) # reshape for broadcasting
+    weighted_x = torch.mul(X, W)
+    if agg == 'mean':
+        return weighted_x.mean(dim=dim)
+    elif agg == 'max':
+        return weighted_x.max(dim=dim)[0]
+    elif agg == 'min':
+        return weighted_x.min(dim=dim)[0]
+    raise ValueError(f"Unknown aggregation function {agg}")
+
 def group_incoming_by_fn(inputs, weights, nodes, max_num_incoming) -> dict:
     # from x shapes: (batch, num_incoming, ...)
     # from w shapes: (num_incoming)
@@ -208,46 +234,79 @@ def group_incoming_by_fn(inputs, weights, nodes, max_num_incoming) -> dict:
        
     return X_W_by_fn
 
-def activate_layer(Xs, Ws, nodes, agg, name_to_fn = af.__dict__):
-    assert len(Xs) == len(Ws) == len(nodes), "Xs, Ws, Fns, and nodes must be the same length"
-    X_W_by_fn = group_incoming_by_fn(Xs, Ws, nodes, max([x.shape[1] for x in Xs])) # dict of (X, W) by node
+class GroupedConv2d:
+    """Applies the Conv2d activations of the nodes of a group as one grouped
+    convolution (`groups=n_nodes`) of their (n, h, w) sums.
+
+    The kernels stay the parameters of the nodes' modules, so mutation and SGD
+    are unchanged. They are concatenated into one (n, 1, k, k) weight per call.
+    """
+    __name__ = "Conv2d"
+
+    def __init__(self, convs):
+        self.convs = convs
+
+    def __call__(self, X):
+        conv = self.convs[0]
+        weight = torch.cat([c.weight for c in self.convs]).to(X.dtype)
+        bias = torch.cat([c.bias for c in self.convs]).to(X.dtype) if conv.bias is not None else None
+        return F.conv2d(X.unsqueeze(0), weight, bias, conv.stride, conv.padding,
+                        conv.dilation, groups=len(self.convs)).squeeze(0)
+
+    @staticmethod
+    def key(conv):
+        """Convolutions with the same key can be grouped."""
+        return (GroupedConv2d, conv.in_channels, conv.out_channels, conv.kernel_size, conv.stride,
+                conv.padding, conv.dilation, conv.groups, conv.bias is None, conv.padding_mode)
+
+
+def activate_group(values, group, weights, biases, agg, node_shape):
+    """Returns the (n, h*w) outputs of one activation group of a layer.
+    params: see `activate_layer`.
+    """
+    fn, positions, sources, weight_index, mask, counts = group
+    n, max_in = sources.shape
+    if agg not in ('sum', 'mean', 'max', 'min'):
+        raise ValueError(f"Unknown aggregation function {agg}. Try `act_mode='node'` for more options.")
+    if max_in == 0:
+        # all inputs were folded into the bias (see graph_optimizer)
+        sums = values.new_zeros((n, values.shape[1]))
+        return fn((sums + biases.index_select(0, positions)).view(n, *node_shape)).view(n, -1)
+    
+    X = values.index_select(0, sources.view(-1)).view(n, max_in, -1) # (n, max_in, h*w)
+    W = weights.index_select(0, weight_index.view(-1)).view(n, max_in) # (n, max_in)
+    
+    if agg == 'sum':
+        sums = torch.bmm(W.unsqueeze(1), X).squeeze(1)
+    elif agg == 'mean':
+        sums = torch.bmm(W.unsqueeze(1), X).squeeze(1) / counts.clamp(min=1)
+    else:
+        fill = -torch.inf if agg == 'max' else torch.inf
+        weighted_x = (X * W.unsqueeze(-1)).masked_fill(~mask.unsqueeze(-1), fill)
+        sums = weighted_x.amax(dim=1) if agg == 'max' else weighted_x.amin(dim=1)
+        sums = sums.masked_fill(counts == 0, 0.0) # nodes without inputs in a group with inputs
     
-    for fn, (ids, X, W) in X_W_by_fn.items():
-        # X shape = (batch, nodes_with_fn, num_incoming, ...)
-        # W shape = (nodes_with_fn, num_incoming)
+    sums = sums + biases.index_select(0, positions)
+    return fn(sums.view(n, *node_shape)).view(n, -1)  # apply activation
 
-        fn = name_to_fn[fn]
-        
-        if agg == 'sum':
-            outputs = torch.einsum('bni...,ni->bn...', X, W)
-        
-        # TODO: I think these are wrong:
-        elif agg == 'mean':
-            outputs = torch.einsum('bni...,ni->bn...', X, W) / torch.sum(W, dim=1, keepdim=True)
-        # elif agg == 'max':
-            # outputs = torch.einsum('bni...,ni->bn...', X, W)
-            # outputs = torch.max(outputs, dim=2)[0]
-        # elif agg == 'min':
-            # outputs = torch.einsum('bni...,ni->bn...', X, W)
-            # outputs = torch.min(outputs, dim=2)[0]
-        
-        else:
-            raise ValueError(f"Unknown aggregation function {agg}. Try `config.activation_mode='node'` for more options.")
-        
-        # add bias
-        #outputs += torch.tensor([node.bias for node in nodes.values() ids], device=outputs.device)
-        
-        # outputs shape should be (batch, nodes_with_fn, ...)
-        
-        outputs = fn(outputs)  # apply activation
-        for idx, id in enumerate(ids):
-            output = outputs[:, idx, ...]
-            nodes.get(id).outputs = output
+def activate_layer(values, groups, weights, biases, agg, node_shape):
+    """Activates one layer of nodes, reading from and writing to `values`.
+    params:
+        values: (num_nodes + 1, h*w) node values, the last row is all zeros.
+        groups: The layer's activation groups from `ExecutionPlan.gather_groups`.
+        weights: The gathered weights followed by a zero for padding.
+        biases: (num_nodes, 1) node biases.
+        agg: The aggregation function of the nodes.
+        node_shape: (h, w)
+    """
+    for group in groups:
+        outputs = activate_group(values, group, weights, biases, agg, node_shape)
+        values.index_copy_(0, group[1], outputs.to(values.dtype))
 
 
 def activate_population(genomes, config, inputs = None,  name_to_fn = af.__dict__):
     if inputs is None:
-        inputs = type(genomes[0]).constant_inputs
+        inputs = type(genomes[0]).initialize_inputs_from_config(config)
     batch_size = 1 # TODO
         
     if isinstance(genomes[0], tuple):
@@ -553,6 +612,39 @@ def creates_cycle(connections, test):
 
 
 
+def recurrent_connections(inputs, nodes, connections):
+    """
+    Returns the set of connections that close a cycle (the back edges of a
+    depth-first search from the inputs, then from the remaining nodes in order).
+    Without them the graph is acyclic. Returns an empty set for feed-forward graphs.
+    :param inputs: list of the input identifiers
+    :param nodes: list of all node identifiers
+    :param connections: list of (input, output) connections in the network.
+    """
+    outgoing = {}
+    for a, b in connections:
+        outgoing.setdefault(a, []).append(b)
+    recurrent = set()
+    state = {} # node -> 1 while on the stack, 2 when done
+    for root in list(inputs) + sorted(nodes):
+        if root in state:
+            continue
+        state[root] = 1
+        stack = [(root, iter(sorted(outgoing.get(root, []))))]
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                state[node] = 2
+                stack.pop()
+            elif state.get(child) == 1:
+                recurrent.add((node, child))
+            elif child not in state:
+                state[child] = 1
+                stack.append((child, iter(sorted(outgoing.get(child, [])))))
+    return recurrent
+
+
 def required_for_output(inputs, outputs, connections):
     """
     Collect the nodes whose state is required to compute the final network output(s).
@@ -601,6 +693,8 @@ def feed_forward_layers(individual):
 
     inputs, outputs, connections = get_ids_from_individual(individual)
     required = required_for_output(inputs, outputs, connections)
+    # recurrent connections read the previous step, so they do not order the layers
+    connections = [c.key for c in individual.enabled_connections() if not c.is_recurrent]
 
     layers = []
     s = set(inputs)
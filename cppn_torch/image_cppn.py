@@ -1,15 +1,16 @@
 import copy
+from collections import OrderedDict
 from typing import List
 
 import torch
 from torch import nn
-from functorch.compile import compiled_function, draw_graph, aot_function
 from typing import Optional, TypeVar, Union
 
 from cppn_torch.config import CPPNConfig as Config
 from cppn_torch import CPPN
 from cppn_torch.gene import NodeType
 from cppn_torch.graph_util import feed_forward_layers, find_node_with_id, get_incoming_connections, hsl2rgb_torch
+from cppn_torch.node_cache import inputs_key
 
 from cppn_torch.normalization import *
 
@@ -17,10 +18,13 @@ from cppn_torch.normalization import *
 imagenet_norm = None
 
 class ImageCPPN(CPPN):
+    unique_inputs_cache = OrderedDict() # (inputs, channels) -> (inputs, (unique inputs, inverse) or None)
+    unique_inputs_cache_size = 8
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
-        if 'imagenet' in self.normalize_outputs:
+        if self.normalize_outputs and 'imagenet' in self.normalize_outputs:
             global imagenet_norm
             if imagenet_norm is None:
                 imagenet_norm = Normalization()
@@ -29,16 +33,22 @@ class ImageCPPN(CPPN):
     def image(self):
         return self.outputs
    
-    def get_image(self, inputs=None, force_recalculate=False, channel_first=True, act_mode='node', use_graph=False):
+    def get_image(self, inputs=None, force_recalculate=False, channel_first=True, act_mode='node', inference=False):
         """Returns an image of the network.
             Extra inputs are (batch_size, num_extra_inputs)
+            Inputs with a leading batch dimension (B, H, W, C) give (B, C, H, W) images.
+            If inference is True, the image is rendered without autograd (see `CPPN.inference`).
         """
         res_h, res_w = inputs.shape[1], inputs.shape[2]
         
         # decide if we need to recalculate the image
         recalculate = False
         recalculate = recalculate or force_recalculate
-        if hasattr(self, "outputs") and isinstance(self.outputs, torch.Tensor):
+        if inputs.dim() == 4:
+            b, h, w = inputs.shape[:3]
+            shape = (b, self.n_outputs, h, w) if channel_first else (b, h, w, self.n_outputs)
+            recalculate = recalculate or not isinstance(self.outputs, torch.Tensor) or tuple(self.outputs.shape) != shape
+        elif hasattr(self, "outputs") and isinstance(self.outputs, torch.Tensor):
             assert self.outputs is not None
             if len(self.color_mode) == 3:
                 if (channel_first and not torch.argmin(torch.tensor(self.outputs.shape)).item() == 0):
@@ -56,65 +66,143 @@ class ImageCPPN(CPPN):
         if not recalculate:
             # return the cached image
             assert self.outputs is not None
-            assert str(self.outputs.device) == str(self.device), f"Output is on {self.outputs.device}, should be {self.device}"
-            
-            assert self.outputs.dtype == torch.float32, f"Image is {self.outputs.dtype}, should be float32"
+            if self.validation == 'per_node':
+                assert str(self.outputs.device) == str(self.device), f"Output is on {self.outputs.device}, should be {self.device}"
+                assert self.outputs.dtype == torch.float32, f"Image is {self.outputs.dtype}, should be float32"
             
             return self.outputs
 
-        self.outputs = self.forward(inputs=inputs, channel_first=channel_first, act_mode=act_mode, use_graph=use_graph)
-       
-        assert self.outputs.dtype == torch.float32, f"Image is {self.outputs.dtype}, should be float32"
-        assert str(self.outputs.device) == str(self.device), f"Image is on {self.outputs.device}, should be {self.device}"
+        if inference:
+            with self.inference():
+                self.outputs = self.forward(inputs=inputs, channel_first=channel_first, act_mode=act_mode)
+        else:
+            self.outputs = self.forward(inputs=inputs, channel_first=channel_first, act_mode=act_mode)
         return self.outputs
 
-    def get_image_data_serial(self, extra_inputs=None):
-        """Evaluate the network to get image data by processing each pixel
-        serially. Much slower than the parallel method, but required if the
-        network has recurrent connections."""
-        raise NotImplementedError("get_image_data_serial is not implemented")
-        # TODO: would be necessary for recurrent networks
+    def get_image_data_serial(self, inputs, channel_first=True, steps=None, tolerance=None):
+        """Evaluate the network to get image data with synchronous update steps,
+        all pixels in parallel (see `CPPN.activate_recurrent`). `forward` uses
+        this for networks with recurrent connections."""
+        if inputs.dim() == 4:
+            # one image at a time, as activations like Conv2d mix neighboring pixels
+            outputs = torch.stack([self.activate_recurrent(x, steps, tolerance) for x in inputs])
+        else:
+            outputs = self.activate_recurrent(inputs, steps, tolerance)
+        if not channel_first:
+            outputs = outputs.movedim(-3, -1)
+        self.outputs = self.finish_forward(outputs, inputs, channel_first)
+        if self.normalize_outputs:
+            self.normalize_image()
+        self.clamp_image()
+        return self.outputs
 
-    def forward(self, inputs=None, channel_first=True, act_mode='node', use_graph=False):
+    def forward(self, inputs=None, channel_first=True, act_mode='node'):
         """Evaluate the network to get output data in parallel
             Extra inputs are (batch_size, num_extra_inputs)
         """
         assert inputs is not None
-        assert inputs.shape[2] == self.n_in_nodes, f"Input shape is {inputs.shape}, should be (h, w, {self.n_in_nodes})"
-        assert str(inputs.device) == str(self.device), f"Inputs are on {inputs.device}, should be {self.device}"
+        assert inputs.shape[-1] == self.n_in_nodes, f"Input shape is {inputs.shape}, should be ([b,] h, w, {self.n_in_nodes})"
+        if self.validation == 'per_node':
+            assert str(inputs.device) == str(self.device), f"Inputs are on {inputs.device}, should be {self.device}"
             
         # evaluate CPPN
-        self.outputs = super().forward(inputs=inputs,
-                                        channel_first=channel_first,
-                                        act_mode=act_mode,
-                                        use_graph=use_graph)
+        unique = self.unique_inputs(inputs)
+        if unique is None:
+            self.outputs = super().forward(inputs=inputs,
+                                            channel_first=channel_first,
+                                            act_mode=act_mode)
+        else:
+            # evaluate only the distinct input tuples and gather them back to the image
+            unique_inputs, inverse = unique
+            outputs = super().forward(inputs=unique_inputs, channel_first=True, act_mode=act_mode)
+            outputs = outputs.view(outputs.shape[0], -1).index_select(1, inverse)
+            outputs = outputs.view(outputs.shape[0], *inputs.shape[:-1])
+            if inputs.dim() == 4:
+                outputs = outputs.transpose(0, 1)
+            if not channel_first:
+                outputs = outputs.movedim(-3, -1)
+            self.outputs = outputs
 
        
         if self.normalize_outputs:
             self.normalize_image()
 
         self.clamp_image()
-                
-        assert str(self.outputs.device)== str(self.device), f"Image is on {self.outputs.device}, should be {self.device}"
-        assert self.outputs.dtype == torch.float32, f"Image is {self.outputs.dtype}, should be float32"
+        
+        if self.validation == 'per_node':
+            assert str(self.outputs.device)== str(self.device), f"Image is on {self.outputs.device}, should be {self.device}"
+            assert self.outputs.dtype == torch.float32, f"Image is {self.outputs.dtype}, should be float32"
         return self.outputs
     
+    def unique_inputs(self, inputs):
+        """Returns (unique inputs, inverse) if the inputs that reach the outputs
+        have few distinct tuples, otherwise None.
+
+        unique inputs is a (n_unique, 1, n_inputs) tensor holding the distinct
+        tuples of the used input channels (unused channels are zero) and
+        inverse is the index of every pixel's tuple. Results are cached per
+        inputs tensor (see `node_cache.inputs_key`) and set of used channels.
+        """
+        if not self.dedup_inputs_fraction or self.output_blur > 0:
+            return None # blurring mixes neighboring pixels
+        plan = self.get_plan()
+        if any(isinstance(fn, nn.Module) for fn in plan.activations):
+            return None # e.g. Conv2d mixes neighboring pixels
+        channels = tuple(plan.used_input_channels())
+        
+        cache = type(self).unique_inputs_cache
+        key = (inputs_key(inputs), channels)
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key][1]
+        
+        unique = self.find_unique_inputs(inputs, channels)
+        cache[key] = (inputs, unique) # keeps the address of the inputs from being reused
+        while len(cache) > type(self).unique_inputs_cache_size:
+            cache.popitem(last=False) # least recently used
+        return unique
+    
+    @torch.inference_mode(False)
+    def find_unique_inputs(self, inputs, channels):
+        """Returns (unique inputs, inverse) of the given channels, or None if
+        there are too many distinct tuples (see `unique_inputs`)."""
+        n_pixels = inputs[..., 0].numel()
+        if len(channels) == 0:
+            values = inputs.new_zeros((1, 0))
+            inverse = torch.zeros(n_pixels, dtype=torch.long, device=inputs.device)
+        else:
+            used = inputs[..., list(channels)].reshape(n_pixels, len(channels))
+            values, inverse = torch.unique(used, dim=0, return_inverse=True)
+        if values.shape[0] > self.dedup_inputs_fraction * n_pixels:
+            return None
+        unique_inputs = torch.zeros((values.shape[0], 1, inputs.shape[-1]), dtype=inputs.dtype, device=inputs.device)
+        unique_inputs[:, 0, list(channels)] = values
+        return (unique_inputs, inverse)
+    
     def clamp_image(self):
         assert self.outputs is not None, "No image to clamp"
-        assert self.outputs.dtype == torch.float32, f"Image is not float32, is {self.outputs.dtype}"
         self.outputs = torch.clamp(self.outputs, 0, 1)
             
     def normalize_image(self):
         """Normalize from outputs (any range) to 0 through 1"""
         assert self.outputs is not None, "No image to normalize"
-        assert self.outputs.dtype == torch.float32, f"Image is not float32, is {self.outputs.dtype}"
-        assert str(self.outputs.device) == str(self.device), f"Image is on {self.outputs.device}, should be {self.device}"
+        if self.validation == 'per_node':
+            assert self.outputs.dtype == torch.float32, f"Image is not float32, is {self.outputs.dtype}"
+            assert str(self.outputs.device) == str(self.device), f"Image is on {self.outputs.device}, should be {self.device}"
         
+        if self.outputs.dim() == 4:
+            # every image of a batch is normalized by itself
+            self.outputs = torch.stack([self.normalize(X) for X in self.outputs])
+        else:
+            self.outputs = self.normalize(self.outputs)
+    
+    def normalize(self, X):
         if self.normalize_outputs:
-            self.outputs = handle_normalization(self.outputs, self.normalize_outputs, imagenet_norm)
+            X = handle_normalization(X, self.normalize_outputs, imagenet_norm)
         if self.color_mode == 'HSL':
             # assume output is HSL and convert to RGB
-            self.outputs = hsl2rgb_torch(self.outputs)
+            X = hsl2rgb_torch(X)
+        return X
         
     def __call__(self, *args, **kwargs):
         return self.get_image(*args, **kwargs)
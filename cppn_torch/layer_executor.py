@@ -0,0 +1,77 @@
+"""Evaluates the independent nodes of a layer concurrently on the CPU."""
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from cppn_torch.graph_util import activate_group
+
+
+def split_groups(groups, n_chunks):
+    """Splits the activation groups of a layer into about `n_chunks` groups
+    of consecutive nodes, in proportion to their sizes."""
+    n_nodes = sum(group[1].shape[0] for group in groups)
+    if len(groups) >= n_chunks:
+        return groups
+    chunks = []
+    for fn, *tensors in groups:
+        n = tensors[0].shape[0]
+        n_split = max(1, min(n, round(n_chunks * n / n_nodes)))
+        for parts in zip(*(t.tensor_split(n_split) for t in tensors)):
+            chunks.append((fn, *parts))
+    return chunks
+
+
+def activate_in_mode(grad_enabled, inference, *args):
+    """Runs `activate_group` with the calling thread's autograd mode, which is thread-local."""
+    with torch.inference_mode(inference), torch.set_grad_enabled(grad_enabled):
+        return activate_group(*args)
+
+
+class LayerExecutor:
+    """A persistent thread pool that evaluates the activation groups of a layer.
+
+    At small resolutions every node is a tiny tensor op that intra-op
+    threading does not speed up, but the nodes of a layer are independent and
+    torch releases the GIL inside ops. Groups (split into chunks of nodes if
+    there are fewer groups than threads) are evaluated on the pool and their
+    outputs written to the node values by the calling thread.
+
+    Each worker limits its intra-op threads to `intra_op_threads` (default
+    `torch.get_num_threads() // num_threads`), so the pool uses about as many
+    cores as a single forward would.
+    """
+
+    def __init__(self, num_threads, intra_op_threads=None):
+        if intra_op_threads is None:
+            intra_op_threads = max(1, torch.get_num_threads() // num_threads)
+        self.num_threads = num_threads
+        self.intra_op_threads = intra_op_threads
+        self.pool = ThreadPoolExecutor(num_threads, thread_name_prefix="cppn-layer",
+                                       initializer=torch.set_num_threads, initargs=(intra_op_threads,))
+
+    def activate_layer(self, values, groups, weights, biases, agg, node_shape):
+        """Same as `graph_util.activate_layer`."""
+        chunks = split_groups(groups, self.num_threads)
+        mode = (torch.is_grad_enabled(), torch.is_inference_mode_enabled())
+        futures = [self.pool.submit(activate_in_mode, *mode, values, chunk, weights, biases, agg, node_shape)
+                   for chunk in chunks]
+        # every chunk reads from earlier layers only, write once all are done
+        outputs = [future.result() for future in futures]
+        for chunk, output in zip(chunks, outputs):
+            values.index_copy_(0, chunk[1], output.to(values.dtype))
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+executors = {} # (num_threads, intra_op_threads) -> LayerExecutor, shared by all genomes
+
+
+def get_executor(num_threads, intra_op_threads=None):
+    """Returns the process-wide executor with the given number of threads."""
+    if intra_op_threads is None:
+        intra_op_threads = max(1, torch.get_num_threads() // num_threads)
+    key = (num_threads, intra_op_threads)
+    if key not in executors:
+        executors[key] = LayerExecutor(num_threads, intra_op_threads)
+    return executors[key]
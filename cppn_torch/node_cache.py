@@ -0,0 +1,118 @@
+"""Caches node outputs by the hash of the subgraph that computes them."""
+import functools
+import hashlib
+from collections import OrderedDict
+
+import torch
+
+
+def subgraph_hash(*parts):
+    """Returns a digest of the given parts, e.g. a node's activation, bias and
+    the hashes and weights of its sources."""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).digest()
+
+
+def inputs_key(inputs):
+    """Identifies an inputs tensor and its contents (see `NodeCache.inputs`).
+
+    Inference tensors (e.g. tiles built in inference mode) have no version
+    counter to tell whether they were modified in-place, so they are keyed
+    by a digest of their contents, which costs one pass over the inputs.
+    """
+    if inputs.is_inference():
+        data = inputs.detach().contiguous().cpu().reshape(-1).view(torch.uint8).numpy()
+        return (hashlib.blake2b(data, digest_size=16).digest(), tuple(inputs.shape),
+                str(inputs.device), inputs.dtype)
+    return (inputs.data_ptr(), tuple(inputs.shape), tuple(inputs.stride()), inputs._version,
+            str(inputs.device), inputs.dtype)
+
+
+def cached_per_inputs(size=8):
+    """Caches the results of `fn(inputs)` per inputs tensor (see `inputs_key`),
+    keeping the `size` most recently used. Results must not be modified.
+
+    Inference tensors are not cached, as keying them costs about as much
+    as the checks this is meant for.
+    """
+    def decorator(fn):
+        cache = OrderedDict() # inputs key -> (inputs, result)
+
+        @functools.wraps(fn)
+        def cached(inputs):
+            if inputs.is_inference():
+                return fn(inputs)
+            key = inputs_key(inputs)
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key][1]
+            result = fn(inputs)
+            cache[key] = (inputs, result) # keeps the address of the inputs from being reused
+            while len(cache) > size:
+                cache.popitem(last=False) # least recently used
+            return result
+        cached.cache = cache
+        return cached
+    return decorator
+
+
+class NodeCache:
+    """An LRU cache of node outputs keyed by subgraph hash.
+
+    A node's hash covers its activation, aggregation, bias and the hashes
+    and weights of its sources, down to the inputs tensor, so after a
+    mutation only the nodes downstream of the change miss. The cache is
+    shared by a genome and its clones, and holds at most `max_bytes` of
+    outputs. Cached outputs must not be modified in-place.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.outputs = OrderedDict() # hash -> output, least recently used first
+        self.inputs = OrderedDict()  # inputs key -> inputs, keeps their address from being reused
+        self.max_inputs = 4
+
+    def track_inputs(self, inputs):
+        """Returns the key of the inputs tensor to hash input nodes with, or None."""
+        key = inputs_key(inputs)
+        if key is None:
+            return None
+        self.inputs[key] = inputs
+        self.inputs.move_to_end(key)
+        while len(self.inputs) > self.max_inputs:
+            self.inputs.popitem(last=False)
+        return key
+
+    def get(self, key):
+        output = self.outputs.get(key)
+        if output is not None:
+            self.outputs.move_to_end(key)
+        return output
+
+    def put(self, key, output):
+        size = output.element_size() * output.nelement()
+        if size > self.max_bytes:
+            return
+        if key in self.outputs:
+            self.nbytes -= self.outputs[key].element_size() * self.outputs[key].nelement()
+        self.outputs[key] = output
+        self.outputs.move_to_end(key)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.outputs.popitem(last=False)
+            self.nbytes -= evicted.element_size() * evicted.nelement()
+
+    def clear(self):
+        self.outputs.clear()
+        self.inputs.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def __getstate__(self):
+        # copies (e.g. pickled genomes) start with an empty cache
+        return {"max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["max_bytes"])
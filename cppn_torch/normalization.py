@@ -113,6 +113,11 @@ class Normalization(nn.Module):
         return self
 
 
+def needs_global_stats(norm):
+    """Returns True if the normalization depends on statistics of the whole image."""
+    return isinstance(norm, str) and 'min_max' in norm
+
+
 def handle_normalization(X, norm, imagenet_norm=None):
     assert callable(norm) or norm in available_normalizations, f"Unknown normalize_outputs value {norm}"
     if norm == "neat":
@@ -0,0 +1,187 @@
+"""Renders CPPN images in tiles so that memory does not grow with the output size."""
+import os
+import struct
+import zlib
+
+import numpy as np
+import torch
+
+from cppn_torch.cppn import CPPN, coordinate_inputs, coordinate_values
+from cppn_torch.graph_util import hsl2rgb_torch
+from cppn_torch.normalization import handle_normalization, needs_global_stats
+
+
+def tile_inputs(y_vals, x_vals, use_radial_dist, use_bias, n_inputs):
+    """Builds the (len(y_vals), len(x_vals), n_inputs) inputs of one tile.
+
+    Channels are laid out as in `CPPN.initialize_inputs`, so a tile of the
+    grid has the same values as the same pixels of the full inputs.
+    """
+    return coordinate_inputs((y_vals.unsqueeze(1), x_vals.unsqueeze(0)), use_radial_dist, use_bias, n_inputs)
+
+
+class TileStats:
+    """Statistics of the raw outputs that the `min_max` normalizations use.
+
+    Holds, per channel, the minimum, the maximum and the value closest to
+    zero (the minimum of abs(X)), both over the whole image and per column
+    (for `min_max_channel`, which reduces over the rows of a (C, H, W)
+    image). Appending these as extra rows to a tile makes the statistics of
+    the tile equal to those of the whole image, so any of these
+    normalizations gives the same result as on the full image.
+    """
+
+    def __init__(self, n_channels, res_w, device):
+        self.columns = torch.stack([
+            torch.full((n_channels, res_w), torch.inf, device=device),
+            torch.full((n_channels, res_w), -torch.inf, device=device),
+            torch.full((n_channels, res_w), torch.inf, device=device),
+        ], dim=1) # (C, 3, W)
+
+    def update(self, X, col):
+        """Adds a (C, h, w) tile whose first column is `col`."""
+        columns = self.columns[:, :, col:col + X.shape[2]]
+        columns[:, 0] = torch.minimum(columns[:, 0], X.amin(dim=1))
+        columns[:, 1] = torch.maximum(columns[:, 1], X.amax(dim=1))
+        # value closest to zero, keeping its sign
+        closest = torch.gather(X, 1, X.abs().argmin(dim=1, keepdim=True)).squeeze(1)
+        columns[:, 2] = torch.where(closest.abs() < columns[:, 2].abs(), closest, columns[:, 2])
+
+    def sentinels(self, norm, col, width):
+        """Returns (C, 3, width) rows to append to the tile at column `col`."""
+        if 'min_max_channel' in norm:
+            return self.columns[:, :, col:col + width]
+        low = self.columns[:, 0].amin(dim=1)
+        high = self.columns[:, 1].amax(dim=1)
+        closest = torch.gather(self.columns[:, 2], 1, self.columns[:, 2].abs().argmin(dim=1, keepdim=True)).squeeze(1)
+        return torch.stack([low, high, closest], dim=1).unsqueeze(-1).expand(-1, -1, width)
+
+
+def postprocess_tile(cppn, X, stats=None, col=0):
+    """Normalizes and clamps a (C, h, w) tile as `ImageCPPN.forward` does the whole image."""
+    norm = cppn.normalize_outputs
+    if norm:
+        from cppn_torch import image_cppn
+        if stats is not None:
+            X = torch.cat((X, stats.sentinels(norm, col, X.shape[2])), dim=1)
+        X = handle_normalization(X, norm, image_cppn.imagenet_norm)
+        if stats is not None:
+            X = X[:, :-3]
+    if cppn.color_mode == 'HSL':
+        X = hsl2rgb_torch(X)
+    return torch.clamp(X, 0, 1)
+
+
+class PNGWriter:
+    """Writes an 8-bit PNG one band of rows at a time."""
+
+    def __init__(self, path, res_h, res_w, n_channels):
+        color_type = {1: 0, 3: 2, 4: 6}[n_channels] # grayscale, RGB, RGBA
+        self.file = open(path, "wb")
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        self.write_chunk(b"IHDR", struct.pack(">IIBBBBB", res_w, res_h, 8, color_type, 0, 0, 0))
+        self.compressor = zlib.compressobj()
+
+    def write_chunk(self, kind, data):
+        self.file.write(struct.pack(">I", len(data)) + kind + data)
+        self.file.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    def write(self, rows):
+        """Appends (h, W, C) uint8 rows."""
+        rows = rows.reshape(rows.shape[0], -1)
+        # every row starts with its filter type (0, no filter)
+        filtered = np.concatenate((np.zeros((rows.shape[0], 1), dtype=np.uint8), rows), axis=1)
+        data = self.compressor.compress(filtered.tobytes())
+        if len(data) > 0:
+            self.write_chunk(b"IDAT", data)
+
+    def close(self):
+        self.write_chunk(b"IDAT", self.compressor.flush())
+        self.write_chunk(b"IEND", b"")
+        self.file.close()
+
+
+def to_uint8(X):
+    """Converts a (C, h, w) tile in [0, 1] to (h, w, C) uint8."""
+    return (X * 255).round().to(torch.uint8).permute(1, 2, 0).cpu().numpy()
+
+
+@torch.inference_mode()
+def render_tiled(cppn, config, path, res_h=None, res_w=None, tile_size=1024, act_mode='layer', two_pass=None):
+    """Renders an image of the CPPN to a .png, .tif(f) or .npy file in tiles.
+
+    Tiles of `tile_size` x `tile_size` pixels are evaluated one at a time
+    from `config.coord_range`, so peak memory is bounded by the tile size
+    (and one band of `tile_size` rows for PNG and TIFF). `.npy` files are
+    written as (H, W, C) float32 memmaps, images as 8-bit.
+
+    params:
+        cppn: The CPPN (or ImageCPPN) to render, its `normalize_outputs` and
+            `color_mode` are applied as in `ImageCPPN.forward`.
+        config: Provides the coordinate range and the input layout.
+        res_h, res_w: The output resolution, defaults to `config.save_h`, `config.save_w`.
+        two_pass: Whether to find global statistics in a first pass before
+            normalizing. Defaults to True for the `min_max` normalizations.
+    returns:
+        The path.
+    """
+    res_h = res_h or config.save_h
+    res_w = res_w or config.save_w
+    if cppn.output_blur > 0:
+        raise ValueError("Output blur mixes neighboring pixels and cannot be applied to tiles.")
+    n_inputs = 2 + config.use_radial_distance + config.use_input_bias
+    if n_inputs != cppn.n_in_nodes:
+        raise ValueError(f"Tiled rendering supports coordinate inputs only, the CPPN has {cppn.n_in_nodes} inputs but tiles have {n_inputs}.")
+    if two_pass is None:
+        two_pass = needs_global_stats(cppn.normalize_outputs)
+
+    y_vals, x_vals = coordinate_values(config.coord_range, res_h, res_w, cppn.device, config.dtype)
+
+    def tiles(row):
+        """Yields (col, raw outputs) of the tiles of one band of rows."""
+        for col in range(0, res_w, tile_size):
+            inputs = tile_inputs(y_vals[row:row + tile_size], x_vals[col:col + tile_size],
+                                 config.use_radial_distance, config.use_input_bias, n_inputs)
+            yield col, CPPN.forward(cppn, inputs, channel_first=True, act_mode=act_mode)
+
+    stats = None
+    if two_pass:
+        stats = TileStats(cppn.n_outputs, res_w, cppn.device)
+        for row in range(0, res_h, tile_size):
+            for col, X in tiles(row):
+                stats.update(X, col)
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(res_h, res_w, cppn.n_outputs))
+        for row in range(0, res_h, tile_size):
+            for col, X in tiles(row):
+                X = postprocess_tile(cppn, X, stats, col)
+                out[row:row + X.shape[1], col:col + X.shape[2]] = X.permute(1, 2, 0).cpu().numpy()
+        out.flush()
+        del out
+        return path
+
+    def bands():
+        for row in range(0, res_h, tile_size):
+            band = np.empty((min(tile_size, res_h - row), res_w, cppn.n_outputs), dtype=np.uint8)
+            for col, X in tiles(row):
+                X = postprocess_tile(cppn, X, stats, col)
+                band[:, col:col + X.shape[2]] = to_uint8(X)
+            yield band
+
+    if ext == ".png":
+        writer = PNGWriter(path, res_h, res_w, cppn.n_outputs)
+        try:
+            for band in bands():
+                writer.write(band)
+        finally:
+            writer.close()
+    elif ext in (".tif", ".tiff"):
+        import tifffile # optional, only needed for TIFF output
+        photometric = "rgb" if cppn.n_outputs == 3 else "minisblack"
+        tifffile.imwrite(path, data=bands(), shape=(res_h, res_w, cppn.n_outputs), dtype=np.uint8,
+                         rowsperstrip=tile_size, photometric=photometric)
+    else:
+        raise ValueError(f"Unknown image format {ext}, use .png, .tif, .tiff or .npy")
+    return path
@@ -0,0 +1,62 @@
+"""Configs, genomes and checks shared by the tests."""
+import unittest
+import torch
+
+from cppn_torch import CPPN, CPPNConfig
+
+
+AGGS = ["sum", "mean", "max", "min"]
+
+
+def make_config(radial=False, bias=False, extra_inputs=0, dedup=True, **attrs):
+    """Returns a CPU config with y, x, the radial distance and bias inputs (if
+    used) and `extra_inputs` more, with the given attributes set."""
+    config = CPPNConfig()
+    config.device = "cpu"
+    config.use_radial_distance = radial
+    config.use_input_bias = bias
+    config.num_inputs = 2 + radial + bias + extra_inputs
+    if not dedup:
+        # renders are compared with tiles, frames or slabs pixel for pixel
+        config.dedup_inputs_fraction = 0
+    for name, value in attrs.items():
+        setattr(config, name, value)
+    return config
+
+
+def grow_cppn(config, rounds=10, add_connections=False, cls=CPPN, seed=0):
+    """Returns a genome grown from a fixed seed by `rounds` rounds of mutate
+    and add_node (and add_connection)."""
+    torch.manual_seed(seed)
+    cppn = cls(config)
+    for _ in range(rounds):
+        cppn.mutate(config)
+        cppn.add_node(config)
+        if add_connections:
+            cppn.add_connection(config)
+    return cppn
+
+
+def assert_matches_node(test, cppn, inputs, act_modes, aggs=AGGS):
+    """Checks that each of `act_modes` evaluates the genome like node mode
+    when all nodes use each of `aggs`."""
+    for agg in aggs:
+        for node in cppn.node_genome.values():
+            node.agg = agg
+        cppn.invalidate_plan()
+        image_node = cppn(inputs, act_mode='node').detach().clone()
+        for act_mode in act_modes:
+            with test.subTest(act_mode=act_mode, agg=agg):
+                image = cppn(inputs, act_mode=act_mode)
+                assert torch.allclose(image_node, image, atol=1e-5), f"{act_mode} differs from node mode with agg {agg}"
+
+
+class GenomeTest(unittest.TestCase):
+    """Sets up a grown genome (with connections added while growing if
+    `add_connections`) and the input grid of its config."""
+    add_connections = False
+
+    def setUp(self):
+        self.config = make_config()
+        self.cppn = grow_cppn(self.config, add_connections=self.add_connections)
+        self.inputs = CPPN.initialize_inputs_from_config(self.config)
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from cppn_torch import ImageCPPN, CPPN
+from cppn_torch.animation import Animation, frame_times, render_animation
+from fixtures import make_config, grow_cppn
+
+class TestAnimation(unittest.TestCase):
+    def setUp(self):
+        self.config = make_config(extra_inputs=1, dedup=False, normalize_outputs="min_max") # time
+        self.cppn = grow_cppn(self.config, rounds=15, add_connections=True, cls=ImageCPPN)
+        self.inputs = CPPN.initialize_inputs(20, 24, False, False, 3, "cpu")
+
+    def images(self, times):
+        images = []
+        for t in times:
+            inputs = self.inputs.clone()
+            inputs[:, :, 2] = t
+            with torch.no_grad():
+                images.append(self.cppn.forward(inputs, act_mode='node').clone())
+        return torch.stack(images)
+
+    def test_frames_match_images(self):
+        animation = Animation(self.cppn, self.inputs)
+        assert len(animation.dependent) < self.cppn.get_plan().num_nodes
+        times = frame_times((0.0, 1.0), 5)
+        outputs = animation.frames(times)
+        images = torch.stack([ImageCPPN.normalize(self.cppn, X).clamp(0, 1) for X in outputs])
+        assert torch.allclose(images, self.images(times), atol=1e-5)
+
+    def test_render(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "animation.npy")
+            assert render_animation(self.cppn, self.inputs, path, (0.0, 1.0), fps=6, batch_size=4) == 6
+            frames = np.load(path)
+            assert np.allclose(frames, self.images(frame_times((0.0, 1.0), 6)).permute(0, 2, 3, 1).numpy(), atol=1e-5)
+            path = os.path.join(directory, "animation.gif")
+            render_animation(self.cppn, self.inputs, path, (0.0, 0.5), fps=6)
+            assert os.path.getsize(path) > 0
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+import torch
+
+from fixtures import GenomeTest
+
+class TestArena(GenomeTest):
+    def test_arena_reuse(self):
+        plan = self.cppn.get_plan()
+        slots, num_slots = plan.allocate_slots()
+        assert num_slots <= plan.num_nodes
+        used = [s for s in slots if s is not None]
+        assert len(set(used)) == num_slots
+
+        self.cppn(self.inputs, act_mode='arena')
+        arena = self.cppn.arena
+        self.cppn(self.inputs, act_mode='arena')
+        assert self.cppn.arena is arena, "Arena was reallocated at the same resolution"
+
+        hidden = [n for n in self.cppn.hidden_nodes().values()]
+        assert all(n.outputs is None for n in hidden), "Intermediate outputs were kept"
+        self.cppn(self.inputs, act_mode='arena', keep_intermediates=True)
+        assert any(n.outputs is not None for n in hidden)
+
+
+if __name__ == "__main__":
+    unittest.main()
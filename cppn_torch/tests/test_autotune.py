@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+import torch
+
+from cppn_torch.autotune import AutoTuner, get_tuner
+from fixtures import GenomeTest
+
+class TestAutotune(GenomeTest):
+    def test_auto_act_mode(self):
+        with tempfile.TemporaryDirectory() as tmp, torch.no_grad():
+            self.cppn.autotune_path = os.path.join(tmp, "act_modes.json")
+            image_node = self.cppn(self.inputs, act_mode='node').clone()
+            image = self.cppn(self.inputs, act_mode='auto')
+            assert torch.allclose(image_node, image, atol=1e-5)
+            with open(self.cppn.autotune_path) as f:
+                table = json.load(f)
+            assert len(table) == 1 and list(table.values())[0] == self.cppn.auto_act_mode[1]
+
+            # later forwards in the bucket do not measure
+            tuner = get_tuner(self.cppn.autotune_path)
+            tuner.measure = None
+            self.cppn.auto_act_mode = None
+            self.cppn(self.inputs, act_mode='auto')
+            child = self.cppn.clone(self.config)
+            child.autotune_path = self.cppn.autotune_path
+            child.mutate_weights(1.0, self.config)
+            child(self.inputs, act_mode='auto')
+            del tuner.measure
+
+            # the table persists across processes
+            assert AutoTuner(self.cppn.autotune_path).table == table
+            self.cppn(self.inputs[:4, :4], act_mode='auto')
+            assert len(AutoTuner(self.cppn.autotune_path).table) == 2
+
+    def test_in_memory_table(self):
+        tuner = get_tuner(None)
+        tuner.table.clear()
+        with mock.patch("cppn_torch.autotune.open", side_effect=AssertionError("The table was written")), torch.no_grad():
+            self.cppn(self.inputs, act_mode='auto')
+        assert len(tuner.table) == 1
+
+    def test_no_candidate(self):
+        with mock.patch("cppn_torch.autotune.candidate_modes", return_value=['unknown']):
+            assert AutoTuner().measure(self.cppn, self.inputs, False) == 'node'
+
+
+if __name__ == "__main__":
+    unittest.main()
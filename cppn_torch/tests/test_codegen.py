@@ -0,0 +1,72 @@
+import functools
+import unittest
+import torch
+
+from cppn_torch import CPPN
+from cppn_torch.activation_functions import sin, gauss
+from cppn_torch.codegen import kernel_cache, structural_hash, broadcast_channels, broadcast_shapes
+from fixtures import GenomeTest
+
+class TestCodegen(GenomeTest):
+    add_connections = True
+
+    def test_structural_hash(self):
+        child = self.cppn.clone(self.config, new_id=True)
+        child.invalidate_plan()
+        assert structural_hash(child.get_plan()) == structural_hash(self.cppn.get_plan())
+
+        for cx in child.connection_genome.values():
+            cx.weight = cx.weight * 2.0
+        child.invalidate_plan()
+        assert structural_hash(child.get_plan()) == structural_hash(self.cppn.get_plan()), "Hash depends on weights"
+
+        for node in child.hidden_nodes().values():
+            node.set_activation(gauss if node.activation != gauss else sin)
+        child.invalidate_plan()
+        assert structural_hash(child.get_plan()) != structural_hash(self.cppn.get_plan())
+
+    def test_unnamed_activations(self):
+        kernel_cache.clear()
+        for fn in [lambda x: x * 2.0, lambda x: x * x, functools.partial(torch.clamp, min=-0.5)]:
+            for node in self.cppn.hidden_nodes().values():
+                node.activation = fn
+            self.cppn.invalidate_plan()
+            image = self.cppn(self.inputs, act_mode='compiled')
+            assert torch.allclose(image, self.cppn(self.inputs, act_mode='node'), atol=1e-5), f"Kernel of another function ran for {fn}"
+        assert kernel_cache.misses == 3
+
+    def test_kernel_reused(self):
+        kernel_cache.clear()
+        self.cppn(self.inputs, act_mode='compiled')
+        child = self.cppn.clone(self.config, new_id=True)
+        for cx in child.connection_genome.values():
+            cx.weight = cx.weight + 0.5
+        image = child(self.inputs, act_mode='compiled')
+        assert kernel_cache.misses == 1 and kernel_cache.hits == 1
+        assert torch.allclose(image, child(self.inputs, act_mode='node'), atol=1e-5)
+
+    def test_broadcast_channels(self):
+        # y, x, radial distance, bias
+        inputs = CPPN.initialize_inputs(12, 20, True, True, 4, "cpu")
+        shapes = [tuple(c.shape) for c in broadcast_channels(inputs)]
+        assert shapes == [(12, 1), (1, 20), (12, 20), (1, 1)], shapes
+
+        # checked once per inputs tensor
+        assert broadcast_shapes(inputs) is broadcast_shapes(inputs)
+        inputs = inputs.clone()
+        shapes = broadcast_shapes(inputs)
+        inputs[0, 0, 3] = 2.0
+        assert broadcast_shapes(inputs) is not shapes and broadcast_shapes(inputs)[3] == (12, 20)
+
+    def test_kernel_any_resolution(self):
+        kernel_cache.clear()
+        for res_h, res_w in [(28, 28), (16, 40)]:
+            inputs = CPPN.initialize_inputs(res_h, res_w, False, False, 2, "cpu")
+            image = self.cppn(inputs, act_mode='compiled')
+            assert image.shape == (3, res_h, res_w)
+            assert torch.allclose(image, self.cppn(inputs, act_mode='node'), atol=1e-5)
+        assert kernel_cache.misses == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
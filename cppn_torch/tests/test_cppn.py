@@ -3,6 +3,9 @@ import unittest
 import torch
 
 from cppn_torch import CPPN, CPPNConfig
+from cppn_torch.fourier_features import apply_mapping
+from cppn_torch.util import gaussian_blur, gaussian_kernel, blur_kernel_size
+from torchvision.transforms import GaussianBlur
 
 class TestCPPN(unittest.TestCase):
     def test_speed(self):
@@ -59,7 +62,88 @@ class TestCPPN(unittest.TestCase):
         image_1 = cppn.forward()
         
         assert torch.isclose(image_0, image_1).all(), f"Images are not close. Difference: {((image_0 - image_1)**2).mean()}"
+    
+    def test_evaluate_points(self):
+        torch.manual_seed(0)
+        config = CPPNConfig()
+        config.device = "cpu"
+        config.use_radial_distance = True
+        config.use_input_bias = True
+        B = torch.randn(3, 2)
+        config.num_inputs += 2 + B.shape[0] * 2
+        config.set_res(24)
+        cppn = CPPN(config)
+        for _ in range(10):
+            cppn.mutate(config)
+            cppn.add_node(config)
+        grid = CPPN.initialize_inputs(24, 24, True, True, 4, "cpu")
+        inputs = torch.cat((grid, apply_mapping(grid[:, :, :2], B, sin_and_cos=True)), dim=-1)
+        image = cppn.forward(inputs, channel_first=False, act_mode='layer')
+        
+        points = torch.randint(0, 24, (100, 2))
+        coords = grid[points[:, 0], points[:, 1], :2]
+        for act_mode in ['node', 'layer']:
+            outputs = cppn.evaluate_points(coords, True, True, B, sin_and_cos=True, chunk_size=32, act_mode=act_mode)
+            assert outputs.shape == (100, 3)
+            assert torch.allclose(outputs, image[points[:, 0], points[:, 1]], atol=1e-5)
+    
+    def test_output_blur(self):
+        torch.manual_seed(0)
+        images = torch.rand(4, 3, 32, 32)
+        for sigma in [0.5, 1.5]:
+            size = blur_kernel_size(sigma)
+            expected = GaussianBlur(size, sigma)(images)
+            assert torch.allclose(gaussian_blur(images, sigma), expected, atol=1e-6)
+            assert torch.allclose(gaussian_blur(images[0], sigma), expected[0], atol=1e-6)
+        hits = gaussian_kernel.cache_info().hits
+        gaussian_blur(images, 1.5)
+        assert gaussian_kernel.cache_info().hits == hits + 2
         
+        config = CPPNConfig()
+        config.device = "cpu"
+        config.output_blur = 1.0
+        cppn = CPPN(config)
+        inputs = CPPN.initialize_inputs_from_config(config)
+        image = cppn(inputs, channel_first=True, act_mode='layer')
+        assert torch.allclose(cppn(inputs, channel_first=False, act_mode='layer'), image.permute(1, 2, 0))
+        batch = cppn(torch.stack([inputs, inputs]), channel_first=True, act_mode='layer')
+        assert torch.allclose(batch[1], image, atol=1e-6)
+
+    def test_device(self):
+        config = CPPNConfig()
+        config.device = "cpu"
+        cppn = CPPN(config)
+        assert cppn.device == torch.device("cpu")
+        inputs = CPPN.initialize_inputs_from_config(config)
+        with self.assertNoLogs(level="WARNING"):
+            cppn(inputs, act_mode='layer') # not moved to the inputs' device
+
+    def test_input_grid_cache(self):
+        CPPN.input_grids.clear()
+        grid = CPPN.initialize_inputs(16, 24, True, True, 4, "cpu")
+        assert CPPN.initialize_inputs(16, 24, True, True, 4, "cpu") is grid
+        assert CPPN.initialize_inputs(16, 24, True, True, 4, "cpu", coord_range=(-1, 1)) is not grid
+        assert CPPN.initialize_inputs(16, 24, True, True, 4, "cpu", dtype=torch.float64).dtype == torch.float64
+
+        # a grid modified in-place is rebuilt
+        grid[0, 0, 0] = 10.0
+        rebuilt = CPPN.initialize_inputs(16, 24, True, True, 4, "cpu")
+        assert rebuilt is not grid and rebuilt[0, 0, 0] == -0.5
+
+        B = torch.randn(3, 2)
+        fourier = CPPN.initialize_inputs(16, 24, True, True, 4 + 6, "cpu", B=B, sin_and_cos=True)
+        points = CPPN.point_inputs(rebuilt[..., :2].reshape(-1, 2), True, True, 10, B, sin_and_cos=True)
+        assert torch.allclose(fourier.reshape(-1, 10), points[:, 0], atol=1e-6)
+        assert CPPN.initialize_inputs(16, 24, True, True, 4 + 6, "cpu", B=B.clone(), sin_and_cos=True) is fourier
+
+        shared = CPPN.initialize_inputs(16, 24, True, True, 4, "cpu", share_memory=True)
+        assert shared.is_shared() and torch.equal(shared, rebuilt)
+
+        for res in range(8, 8 + CPPN.input_grids_size + 1):
+            CPPN.initialize_inputs(res, res, True, True, 4, "cpu")
+        assert len(CPPN.input_grids) == CPPN.input_grids_size
+        assert CPPN.initialize_inputs(16, 24, True, True, 4, "cpu") is not shared
+
         
         
 if __name__ == "__main__":
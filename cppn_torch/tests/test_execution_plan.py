@@ -0,0 +1,44 @@
+import unittest
+import torch
+
+from fixtures import GenomeTest
+
+class TestExecutionPlan(GenomeTest):
+    def test_plan_reused(self):
+        image_0 = self.cppn(self.inputs)
+        plan = self.cppn.plan
+        assert plan is not None
+        image_1 = self.cppn(self.inputs)
+        assert self.cppn.plan is plan, "Plan was rebuilt without a structural change"
+        assert torch.equal(image_0, image_1)
+
+    def test_plan_invalidated(self):
+        self.cppn(self.inputs)
+        plan = self.cppn.plan
+        self.cppn.add_node(self.config)
+        assert self.cppn.plan is None
+        self.cppn(self.inputs)
+        assert self.cppn.plan is not plan
+
+        plan = self.cppn.plan
+        self.cppn.mutate(self.config)
+        assert self.cppn.plan is None
+
+    def test_weight_change_reuses_plan(self):
+        image_0 = self.cppn(self.inputs).clone()
+        plan = self.cppn.plan
+        for cx in self.cppn.connection_genome.values():
+            cx.weight = cx.weight + 1.0
+        image_1 = self.cppn(self.inputs)
+        assert self.cppn.plan is plan
+        assert not torch.equal(image_0, image_1), "Weight change had no effect"
+
+    def test_clone_shares_plan(self):
+        self.cppn(self.inputs)
+        child = self.cppn.clone(self.config)
+        assert child.plan is self.cppn.plan
+        assert torch.allclose(child(self.inputs), self.cppn(self.inputs))
+
+
+if __name__ == "__main__":
+    unittest.main()
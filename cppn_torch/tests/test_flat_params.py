@@ -0,0 +1,41 @@
+import pickle
+import unittest
+import torch
+
+from fixtures import GenomeTest
+
+class TestFlatParams(GenomeTest):
+    def test_flat_params(self):
+        image_0 = self.cppn(self.inputs, act_mode='layer').detach().clone()
+        flat = self.cppn.flat_params
+        key, cx = next(iter(self.cppn.connection_genome.items()))
+        assert cx.weight.data_ptr() == flat.weights[flat.cx_index[key]].data_ptr()
+
+        # weight-only mutations update the vectors in-place
+        child = self.cppn.clone(self.config)
+        self.cppn.mutate_weights(1.0, self.config)
+        self.cppn.mutate_bias(1.0, self.config)
+        assert self.cppn.flat_params is flat
+        assert torch.equal(cx.weight, flat.weights[flat.cx_index[key]])
+        image_1 = self.cppn(self.inputs, act_mode='layer').detach().clone()
+        assert self.cppn.flat_params is flat and not torch.equal(image_0, image_1)
+        assert torch.allclose(child(self.inputs, act_mode='layer'), image_0), "Clone shares the parent's vectors"
+        image_node = self.cppn(self.inputs, act_mode='node').detach()
+        assert torch.allclose(image_node, image_1, atol=1e-5)
+
+        # assigning a gene repacks
+        cx.weight = cx.weight + 1.0
+        assert not flat.valid
+        image_2 = self.cppn(self.inputs, act_mode='layer').detach()
+        assert self.cppn.flat_params is not flat and not torch.equal(image_1, image_2)
+
+        # optimizer steps update the genes
+        self.cppn.prepare_optimizer(create_opt=True)
+        weight = cx.weight.item()
+        self.cppn.backward(self.cppn(self.inputs, act_mode='layer').square().mean())
+        assert cx.weight.item() != weight
+        assert pickle.loads(pickle.dumps(cx)).weight.item() == cx.weight.item()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import torch
+
+from cppn_torch import CPPN, Connection
+from cppn_torch.activation_functions import identity, sin, gauss
+from cppn_torch.graph_optimizer import constant_channels
+from fixtures import assert_matches_node, make_config, grow_cppn
+
+class TestGraphOptimizer(unittest.TestCase):
+    def setUp(self):
+        self.config = make_config(bias=True, optimize_graph=True, activations=[identity, sin, gauss])
+        self.cppn = grow_cppn(self.config, rounds=20, add_connections=True)
+        for i, cx in enumerate(self.cppn.connection_genome.values()):
+            if i % 5 == 0:
+                cx.weight = torch.zeros_like(cx.weight)
+        self.inputs = CPPN.initialize_inputs_from_config(self.config)
+
+    def test_reduced_matches_node(self):
+        with torch.no_grad():
+            assert_matches_node(self, self.cppn, self.inputs, ['layer', 'arena', 'compiled'])
+
+    def test_zero_edges(self):
+        for cx in self.cppn.connection_genome.values():
+            cx.weight = torch.zeros_like(cx.weight)
+        with torch.no_grad():
+            assert_matches_node(self, self.cppn, self.inputs, ['layer', 'sparse', 'arena', 'compiled'], ["mean", "sum"])
+        assert len(self.cppn.reduced_plan.cx_keys) == 0
+
+    def test_bias_only(self):
+        plan = self.cppn.get_plan()
+        bias_id = next(plan.node_ids[pos] for pos in plan.layers[0]
+                       if plan.input_channels[pos] == self.config.num_inputs - 1)
+        for cx in self.cppn.connection_genome.values():
+            if cx.key[0] != bias_id:
+                cx.weight = torch.zeros_like(cx.weight)
+        for node_id in plan.output_ids:
+            self.cppn.connection_genome[(bias_id, node_id)] = Connection((bias_id, node_id), torch.tensor(0.7))
+        with torch.no_grad():
+            assert_matches_node(self, self.cppn, self.inputs, ['layer', 'sparse', 'arena', 'compiled'], ["sum"])
+
+    def test_graph_reduced(self):
+        with torch.no_grad():
+            self.cppn(self.inputs, act_mode='layer')
+        plan, reduced = self.cppn.plan, self.cppn.reduced_plan
+        assert reduced is not None and reduced.base is plan
+        assert reduced.num_nodes < plan.num_nodes
+        assert len(reduced.cx_keys) < len(plan.cx_keys)
+
+    def test_constant_channels(self):
+        constants = constant_channels(self.inputs)
+        assert constants == {self.config.num_inputs - 1: 1.0} # the input bias
+        assert constant_channels(self.inputs) is constants, "Channels were checked again"
+        with torch.inference_mode():
+            assert constant_channels(self.inputs.clone()) == constants
+
+    def test_genome_untouched(self):
+        nodes = {i: (n.activation, n.bias.clone()) for i, n in self.cppn.node_genome.items()}
+        cxs = {k: (cx.weight.clone(), cx.enabled) for k, cx in self.cppn.connection_genome.items()}
+        with torch.no_grad():
+            self.cppn(self.inputs, act_mode='layer')
+        assert nodes.keys() == self.cppn.node_genome.keys()
+        assert cxs.keys() == self.cppn.connection_genome.keys()
+        for i, (fn, bias) in nodes.items():
+            assert self.cppn.node_genome[i].activation is fn and torch.equal(self.cppn.node_genome[i].bias, bias)
+        for k, (weight, enabled) in cxs.items():
+            cx = self.cppn.connection_genome[k]
+            assert torch.equal(cx.weight, weight) and cx.enabled == enabled
+
+    def test_rebuilt_on_weight_change(self):
+        with torch.no_grad():
+            self.cppn(self.inputs, act_mode='layer')
+            reduced = self.cppn.reduced_plan
+            self.cppn(self.inputs, act_mode='layer')
+            assert self.cppn.reduced_plan is reduced
+            for cx in self.cppn.connection_genome.values():
+                cx.weight = cx.weight + 0.5
+            image = self.cppn(self.inputs, act_mode='layer').clone()
+            assert self.cppn.reduced_plan is not reduced
+            self.cppn.optimize_graph = False
+            assert torch.allclose(image, self.cppn(self.inputs, act_mode='layer'), atol=1e-5)
+
+    def test_not_used_with_grad(self):
+        params = self.cppn.prepare_optimizer()
+        self.cppn(self.inputs, act_mode='layer').mean().backward()
+        assert self.cppn.reduced_plan is None
+        assert any(p.grad is not None for p in params)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+import torch
+
+from cppn_torch.graph_util import GroupedConv2d
+from fixtures import GenomeTest
+
+class TestGroupedConv(GenomeTest):
+    def test_grouped_conv(self):
+        hidden = list(self.cppn.hidden_nodes().values())
+        for node in hidden:
+            node.set_activation(torch.nn.Conv2d)
+        self.cppn.invalidate_plan()
+        groups = [g for layer in self.cppn.get_plan().activation_groups() for g in layer
+                  if isinstance(g[0], GroupedConv2d)]
+        assert max(len(g[1]) for g in groups) > 1
+        assert sum(len(g[1]) for g in groups) == len(hidden)
+
+        image_node = self.cppn(self.inputs, act_mode='node').detach().clone()
+        for act_mode in ['layer', 'sparse']:
+            for node in hidden:
+                node.activation.weight.grad = None
+            image = self.cppn(self.inputs, act_mode=act_mode)
+            assert torch.allclose(image_node, image, atol=1e-5)
+            image.mean().backward()
+            assert all(node.activation.weight.grad is not None for node in hidden
+                       if node.id in self.cppn.get_plan().index)
+
+
+if __name__ == "__main__":
+    unittest.main()
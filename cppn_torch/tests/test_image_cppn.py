@@ -2,7 +2,7 @@ import random
 import time
 import unittest
 import torch
-from cppn_torch import ImageCPPN, CPPNConfig
+from cppn_torch import ImageCPPN, CPPNConfig, CPPN
 from cppn_torch.activation_functions import *
 
 class TestImageCPPN(unittest.TestCase):
@@ -164,6 +164,63 @@ class TestImageCPPN(unittest.TestCase):
             image = cppn.get_image(const_inputs)
         print(f"Generated 300 32x32 images with {len(config.activations)} activations in: {time.time() - s}")
     
+    def test_unique_inputs(self):
+        torch.manual_seed(0)
+        config = CPPNConfig()
+        config.device = "cpu"
+        config.use_radial_distance = True
+        config.num_inputs += 1
+        config.set_res(64)
+        cppn = ImageCPPN(config)
+        for _ in range(5):
+            cppn.mutate(config)
+            cppn.add_node(config)
+        # only the radial distance reaches the outputs
+        for key, cx in cppn.connection_genome.items():
+            if key[0] in (-1, -2):
+                cx.enabled = False
+        cppn.invalidate_plan()
+        inputs = CPPN.initialize_inputs_from_config(config)
+        
+        cppn.dedup_inputs_fraction = 0
+        image_0 = cppn.forward(inputs).clone()
+        cppn.dedup_inputs_fraction = 0.5
+        unique_inputs, inverse = cppn.unique_inputs(inputs)
+        assert unique_inputs.shape[0] < 64 * 64 / 4
+        assert cppn.unique_inputs(inputs)[1] is inverse, "Unique inputs were not cached"
+        image_1 = cppn.forward(inputs)
+        assert torch.equal(image_0, image_1)
+        
+        # inference tensors (e.g. tiles) have no version counter
+        with torch.inference_mode():
+            inference_inputs = inputs.clone()
+        image_2 = cppn.get_image(inference_inputs, force_recalculate=True)
+        assert torch.equal(image_2, cppn.get_image(inputs, force_recalculate=True))
+        with torch.inference_mode():
+            same_inputs = inputs.clone() # same contents, new tensor
+        assert cppn.unique_inputs(same_inputs)[1] is cppn.unique_inputs(inference_inputs)[1]
+    
+    def test_batch(self):
+        torch.manual_seed(0)
+        config = CPPNConfig()
+        config.device = "cpu"
+        config.normalize_outputs = "min_max"
+        config.set_res(20)
+        cppn = ImageCPPN(config)
+        for _ in range(10):
+            cppn.mutate(config)
+            cppn.add_node(config)
+        inputs = torch.stack([CPPN.initialize_inputs(20, 24, False, False, 2, "cpu", coord_range=(-r, r))
+                              for r in (0.5, 1.0, 2.0)]).clone()
+        images = {}
+        for act_mode in ['node', 'layer', 'compiled']:
+            images[act_mode] = torch.stack([cppn.forward(x, act_mode=act_mode).clone() for x in inputs])
+            batch = cppn.get_image(inputs, force_recalculate=True, act_mode=act_mode)
+            assert batch.shape == (3, 3, 20, 24)
+            assert torch.allclose(batch, images[act_mode], atol=1e-5), f"Batch differs in {act_mode}"
+        batch = cppn.get_image(inputs, force_recalculate=True, channel_first=False, act_mode='layer')
+        assert torch.allclose(batch, images['layer'].permute(0, 2, 3, 1), atol=1e-5)
+    
     def test_aggs(self):
         return
         aggs = ["sum", "mean", "max", "min"]
@@ -0,0 +1,26 @@
+import unittest
+import torch
+
+from fixtures import GenomeTest
+
+class TestInference(GenomeTest):
+    def test_inference(self):
+        params = self.cppn.prepare_optimizer()
+        for act_mode in ['node', 'layer', 'arena', 'sparse', 'compiled']:
+            self.cppn.invalidate_plan()
+            with self.cppn.inference():
+                image = self.cppn(self.inputs, act_mode=act_mode)
+            assert image.grad_fn is None and not image.requires_grad
+            for node in self.cppn.node_genome.values():
+                assert node.outputs is None or node.outputs.grad_fn is None, f"Node {node.id} kept an autograd graph"
+            if act_mode == 'arena':
+                continue
+            # the plan built during inference can be used with gradients
+            for p in params:
+                p.grad = None
+            self.cppn(self.inputs, act_mode=act_mode).mean().backward()
+            assert any(p.grad is not None for p in params)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+import torch
+
+from cppn_torch.layer_executor import split_groups
+from fixtures import GenomeTest
+
+class TestLayerExecutor(GenomeTest):
+    def test_layer_threads(self):
+        params = self.cppn.prepare_optimizer()
+        image = self.cppn(self.inputs, act_mode='layer')
+        image.square().mean().backward()
+        grads = [p.grad.clone() for p in params]
+        self.cppn.layer_threads = 4
+        for p in params:
+            p.grad = None
+        image_threads = self.cppn(self.inputs, act_mode='layer')
+        assert torch.allclose(image, image_threads, atol=1e-6)
+        image_threads.square().mean().backward()
+        for g, g_threads in zip(grads, params):
+            assert torch.allclose(g, g_threads.grad, atol=1e-6)
+        with self.cppn.inference():
+            assert torch.allclose(self.cppn(self.inputs, act_mode='layer'), image, atol=1e-6)
+
+        groups = self.cppn.get_plan().gather_groups()[0]
+        chunks = split_groups(groups, 8)
+        assert len(chunks) >= min(8, sum(len(g[1]) for g in groups))
+        assert sorted(torch.cat([c[1] for c in chunks]).tolist()) == sorted(torch.cat([g[1] for g in groups]).tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
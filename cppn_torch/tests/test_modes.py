@@ -0,0 +1,28 @@
+import unittest
+import torch
+
+from fixtures import AGGS, GenomeTest, assert_matches_node
+
+# activation mode -> the aggregations it supports
+MODES = {
+    'arena': AGGS,
+    'sparse': ["sum", "mean"],
+    'compiled': AGGS,
+    'layer': AGGS,
+}
+
+class TestModes(GenomeTest):
+    add_connections = True
+
+    def setUp(self):
+        super().setUp()
+        for node in self.cppn.node_genome.values():
+            node.bias = torch.randn(1) * 0.3
+
+    def test_matches_node(self):
+        for act_mode, aggs in MODES.items():
+            assert_matches_node(self, self.cppn, self.inputs, [act_mode], aggs)
+
+
+if __name__ == "__main__":
+    unittest.main()
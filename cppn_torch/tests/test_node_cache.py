@@ -0,0 +1,77 @@
+import pickle
+import unittest
+import torch
+
+from cppn_torch import CPPN
+from fixtures import make_config, grow_cppn
+
+class TestNodeCache(unittest.TestCase):
+    def setUp(self):
+        self.config = make_config(node_cache_bytes=2**24)
+        self.cppn = grow_cppn(self.config)
+        self.inputs = CPPN.initialize_inputs_from_config(self.config)
+
+    def render(self, cppn):
+        with torch.no_grad():
+            return cppn(self.inputs, act_mode='layer').clone()
+
+    def test_matches_node(self):
+        image = self.render(self.cppn)
+        cache = self.cppn.node_cache
+        n_cached = len(cache) # nodes with identical subgraphs share an entry
+        assert 0 < n_cached <= self.cppn.get_plan().num_nodes
+        self.cppn.node_cache = None
+        assert torch.allclose(image, self.render(self.cppn), atol=1e-6)
+        self.cppn.node_cache = cache
+        assert torch.equal(image, self.render(self.cppn))
+        assert len(cache) == n_cached, "Unchanged nodes were recomputed"
+
+    def test_only_downstream_recomputed(self):
+        self.render(self.cppn)
+        plan = self.cppn.get_plan()
+        key = plan.cx_keys[len(plan.cx_keys) // 2]
+        child = self.cppn.clone(self.config)
+        assert child.node_cache is self.cppn.node_cache
+        child.connection_genome[key].weight = child.connection_genome[key].weight + 0.5
+        n_cached = len(child.node_cache)
+        image = self.render(child)
+        downstream = plan.dependent_positions([]) | {plan.index[key[1]]}
+        for pos in range(plan.num_nodes):
+            if any(s in downstream for s in plan.source_positions[pos]):
+                downstream.add(pos)
+        assert 0 < len(child.node_cache) - n_cached <= len(downstream)
+        child.node_cache = None
+        assert torch.allclose(image, self.render(child), atol=1e-6)
+
+    def test_budget(self):
+        self.cppn.node_cache.max_bytes = 3 * self.inputs[:, :, 0].nelement() * 4
+        image = self.render(self.cppn)
+        assert len(self.cppn.node_cache) == 3
+        assert self.cppn.node_cache.nbytes <= self.cppn.node_cache.max_bytes
+        assert torch.equal(image, self.render(self.cppn))
+        assert len(pickle.loads(pickle.dumps(self.cppn.node_cache))) == 0
+
+    def test_inference_inputs(self):
+        with torch.inference_mode():
+            inputs = self.inputs.clone() # an inference tensor, e.g. a tile of render_tiled
+        with self.cppn.inference():
+            image = self.cppn(inputs, act_mode='layer').clone()
+            n_cached = len(self.cppn.node_cache)
+            assert n_cached > 0
+            with torch.inference_mode():
+                inputs = self.inputs.clone() # same contents, new tensor
+            assert torch.equal(image, self.cppn(inputs, act_mode='layer'))
+            assert len(self.cppn.node_cache) == n_cached, "Nodes were recomputed for the same inputs"
+            with torch.inference_mode():
+                inputs[:, :, 0] += 1.0
+            self.cppn(inputs, act_mode='layer')
+            assert len(self.cppn.node_cache) > n_cached
+
+    def test_not_used_with_grad(self):
+        self.cppn.prepare_optimizer()
+        self.cppn(self.inputs, act_mode='layer').mean().backward()
+        assert len(self.cppn.node_cache) == 0
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from unittest import mock
+import torch
+
+from cppn_torch import Connection
+from fixtures import GenomeTest
+
+class TestRecurrent(GenomeTest):
+    def test_recurrent(self):
+        assert not any(cx.is_recurrent for cx in self.cppn.connection_genome.values())
+        self.config.allow_recurrent = True
+        for _ in range(20):
+            self.cppn.add_connection(self.config)
+        recurrent = [k for k, cx in self.cppn.connection_genome.items() if cx.is_recurrent]
+        assert len(recurrent) > 0
+        plan = self.cppn.get_plan()
+        assert plan.has_recurrent
+        
+        # reference: node by node, recurrent connections read the previous step
+        current = {}
+        for step in range(4):
+            previous = dict(current)
+            for node_id in plan.node_ids:
+                node = self.cppn.node_genome[node_id]
+                if plan.is_input(plan.index[node_id]):
+                    X = self.inputs[:, :, plan.input_channels[plan.index[node_id]]]
+                else:
+                    X = sum(cx.weight * (previous.get(k[0], 0.0) if cx.is_recurrent else current[k[0]])
+                            for k, cx in self.cppn.connection_genome.items()
+                            if k[1] == node_id and cx.enabled and k[0] in plan.index)
+                current[node_id] = node.activation(X + node.bias)
+        expected = torch.stack([current[i] for i in plan.output_ids])
+        
+        self.cppn.recurrent_steps = 4
+        for act_mode in ['node', 'layer']:
+            assert torch.allclose(self.cppn(self.inputs, act_mode=act_mode), expected, atol=1e-3)
+        outputs = self.cppn.activate_recurrent(self.inputs, steps=100, tolerance=1e-4)
+        assert torch.isfinite(outputs).all()
+
+    def test_reenabled_recurrent(self):
+        self.config.allow_recurrent = True
+        self.config.prob_reenable_connection = 1.0
+        a, b = next(k for k, cx in self.cppn.connection_genome.items()
+                    if cx.enabled and k[0] in self.cppn.hidden_nodes() and k[1] in self.cppn.hidden_nodes())
+        cx = Connection((b, a), torch.tensor(0.5), enabled=False)
+        self.cppn.connection_genome[cx.key] = cx
+        self.cppn.update_node_layers()
+        assert not self.cppn.get_plan().has_recurrent
+        nodes = [self.cppn.node_genome[b], self.cppn.node_genome[a]]
+        with mock.patch("cppn_torch.cppn.random_choice", return_value=nodes):
+            self.cppn.add_connection(self.config)
+        assert cx.enabled
+        # the cycle it closes is marked as recurrent
+        assert self.cppn.connection_genome[(a, b)].is_recurrent or cx.is_recurrent
+        assert self.cppn.get_plan().has_recurrent
+
+
+if __name__ == "__main__":
+    unittest.main()
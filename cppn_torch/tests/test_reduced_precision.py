@@ -0,0 +1,33 @@
+import unittest
+import torch
+
+from fixtures import GenomeTest
+
+class TestReducedPrecision(GenomeTest):
+    def test_reduced_precision(self):
+        image_full = self.cppn(self.inputs, act_mode='layer').detach().clone()
+        self.cppn.compute_dtype = torch.bfloat16
+        for act_mode in ['layer', 'arena', 'compiled']:
+            self.cppn.precision_guard = 0.0
+            image = self.cppn(self.inputs, act_mode=act_mode)
+            assert image.dtype == torch.float32
+            assert torch.allclose(image, image_full, atol=0.1), f"{act_mode} is too far from full precision"
+            # falls back to full precision when the sample error is too large
+            self.cppn.precision_guard = 1e-7
+            image = self.cppn(self.inputs, act_mode=act_mode)
+            assert torch.allclose(image, image_full, atol=1e-5)
+
+    def test_precision_guard_state(self):
+        self.cppn.compute_dtype = torch.bfloat16
+        self.cppn.precision_guard = 1.0
+        output_id = self.cppn.get_plan().output_ids[0]
+        for act_mode in ['layer', 'arena']:
+            self.cppn(self.inputs, act_mode=act_mode)
+            assert self.cppn.node_genome[output_id].outputs.shape == self.inputs.shape[:2]
+        arena = self.cppn.arena
+        self.cppn(self.inputs, act_mode='arena')
+        assert self.cppn.arena is arena, "The guard sample reallocated the arena"
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+from PIL import Image
+
+from cppn_torch import ImageCPPN, CPPN
+from cppn_torch.cppn import coordinate_values
+from cppn_torch.render import render_tiled, tile_inputs
+from fixtures import make_config, grow_cppn
+
+class TestRender(unittest.TestCase):
+    def setUp(self):
+        self.config = make_config(radial=True, bias=True, dedup=False)
+        self.config.set_res(40)
+        self.config.res_w = 52
+        self.cppn = grow_cppn(self.config, cls=ImageCPPN)
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def full_image(self):
+        inputs = CPPN.initialize_inputs_from_config(self.config)
+        with torch.no_grad():
+            return self.cppn.forward(inputs, channel_first=True, act_mode='layer').permute(1, 2, 0).numpy()
+
+    def test_npy_matches_full_image(self):
+        path = os.path.join(self.dir.name, "image.npy")
+        for norm in ["neat", "sigmoid_like", "min_max", "abs_min_max", "inv_abs_min_max_sqr", "min_max_channel"]:
+            self.cppn.normalize_outputs = norm
+            image = self.full_image()
+            render_tiled(self.cppn, self.config, path, 40, 52, tile_size=16)
+            tiled = np.load(path, mmap_mode="r")
+            assert tiled.shape == image.shape
+            assert np.allclose(tiled, image, atol=1e-5), f"Tiles differ with {norm}"
+
+    def test_json_coord_range(self):
+        self.config.coord_range = [[-1.0, 1.0], [-0.5, 0.25]] # lists, as loaded from json
+        self.cppn.normalize_outputs = "neat"
+        image = self.full_image()
+        path = render_tiled(self.cppn, self.config, os.path.join(self.dir.name, "image.npy"), 40, 52, tile_size=16)
+        assert np.allclose(np.load(path), image, atol=1e-5)
+
+    def test_tile_image(self):
+        # tiles are inference tensors, ImageCPPN evaluates their unique inputs
+        self.cppn.normalize_outputs = "neat"
+        image = self.full_image()
+        self.cppn.dedup_inputs_fraction = 1.0
+        y_vals, x_vals = coordinate_values(self.config.coord_range, 40, 52, "cpu", torch.float32)
+        with torch.inference_mode():
+            tile = tile_inputs(y_vals[8:24], x_vals[16:48], True, True, self.config.num_inputs)
+            output = self.cppn.get_image(tile, force_recalculate=True, channel_first=False, act_mode='layer')
+        assert np.allclose(output.numpy(), image[8:24, 16:48], atol=1e-5)
+
+    def test_images(self):
+        self.cppn.normalize_outputs = "min_max"
+        image = np.round(self.full_image() * 255).astype(np.uint8)
+        for ext in [".png", ".tif"]:
+            path = render_tiled(self.cppn, self.config, os.path.join(self.dir.name, "image" + ext), 40, 52, tile_size=16)
+            tiled = np.asarray(Image.open(path))
+            assert tiled.shape == image.shape
+            assert np.abs(tiled.astype(int) - image).max() <= 1, f"{ext} differs"
+
+    def test_output_blur(self):
+        self.cppn.output_blur = 1.0
+        with self.assertRaises(ValueError):
+            render_tiled(self.cppn, self.config, os.path.join(self.dir.name, "image.npy"), 40, 52)
+
+
+if __name__ == "__main__":
+    unittest.main()
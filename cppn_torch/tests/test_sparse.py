@@ -0,0 +1,20 @@
+import unittest
+import torch
+
+from fixtures import GenomeTest
+
+class TestSparse(GenomeTest):
+    def test_sparse_grad(self):
+        params = self.cppn.prepare_optimizer()
+        grads = []
+        for act_mode in ['node', 'sparse']:
+            for p in params:
+                p.grad = None
+            self.cppn(self.inputs, act_mode=act_mode).square().mean().backward()
+            grads.append([p.grad.clone() if p.grad is not None else torch.zeros_like(p) for p in params])
+        for g_node, g_sparse in zip(*grads):
+            assert torch.allclose(g_node, g_sparse, atol=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import copy
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+from PIL import Image
+
+from cppn_torch import ImageCPPN
+from cppn_torch.render import render_tiled, tile_inputs
+from cppn_torch.tile_pyramid import TilePyramid
+from fixtures import make_config, grow_cppn
+
+class TestTilePyramid(unittest.TestCase):
+    def setUp(self):
+        self.config = make_config(radial=True, dedup=False)
+        self.cppn = grow_cppn(self.config, cls=ImageCPPN)
+        self.cppn.normalize_outputs = "neat"
+        self.dir = tempfile.TemporaryDirectory()
+        self.pyramid = TilePyramid(self.config, os.path.join(self.dir.name, "tiles"), tile_size=16)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self, path):
+        return np.asarray(Image.open(path))
+
+    def test_level_matches_image(self):
+        path = render_tiled(self.cppn, self.config, os.path.join(self.dir.name, "image.png"), 32, 32)
+        image = self.read(path)
+        for ty in range(2):
+            for tx in range(2):
+                tile = self.read(self.pyramid.get_tile(self.cppn, 1, tx, ty))
+                assert np.array_equal(tile, image[ty * 16:(ty + 1) * 16, tx * 16:(tx + 1) * 16])
+
+    def test_cache(self):
+        path = self.pyramid.get_tile(self.cppn, 2, 1, 3)
+        assert self.pyramid.get_tile(self.cppn, 2, 1, 3) == path
+        assert TilePyramid(self.config, self.pyramid.cache_dir).index.keys() == {path}
+        self.cppn.mutate(self.config)
+        assert self.pyramid.get_tile(self.cppn, 2, 1, 3) != path, "Tile of a mutated genome was reused"
+        with self.assertRaises(ValueError):
+            self.pyramid.get_tile(self.cppn, 2, 4, 0)
+
+    def test_settings_in_key(self):
+        path = self.pyramid.get_tile(self.cppn, 1, 0, 0)
+        for name, value in [("coord_range", (-1.0, 1.0)), ("use_input_bias", True), ("dtype", torch.float64)]:
+            config = copy.deepcopy(self.config)
+            setattr(config, name, value)
+            assert TilePyramid(config, self.pyramid.cache_dir).get_tile(self.cppn, 1, 0, 0) != path, f"Tiles reused after changing {name}"
+        assert TilePyramid(self.config, self.pyramid.cache_dir, tile_size=8).get_tile(self.cppn, 1, 0, 0) != path
+        assert TilePyramid(self.config, self.pyramid.cache_dir, tile_size=16).get_tile(self.cppn, 1, 0, 0) == path
+
+    def test_stats_bounded(self):
+        self.cppn.normalize_outputs = "min_max"
+        self.pyramid.stats_size = 2
+        for _ in range(4):
+            self.cppn.mutate(self.config)
+            self.pyramid.get_tile(self.cppn, 0, 0, 0)
+        assert len(self.pyramid.stats) == 2
+
+    def test_tile_image(self):
+        # the inputs of a tile are inference tensors, ImageCPPN evaluates their unique inputs
+        path = self.pyramid.get_tile(self.cppn, 1, 1, 0)
+        self.cppn.dedup_inputs_fraction = 1.0
+        y_vals, x_vals = self.pyramid.coordinates(1, 1, 0)
+        with torch.inference_mode():
+            inputs = tile_inputs(y_vals.float(), x_vals.float(), True, False, self.config.num_inputs)
+            image = self.cppn.get_image(inputs, force_recalculate=True, channel_first=False)
+        image = np.round(image.numpy() * 255).astype(int)
+        assert np.abs(image - self.read(path)).max() <= 1
+
+    def test_eviction(self):
+        self.pyramid.cache_size = 3
+        paths = [self.pyramid.get_tile(self.cppn, 2, tx, 0) for tx in range(3)]
+        self.pyramid.get_tile(self.cppn, 2, 0, 0) # most recently used
+        self.pyramid.get_tile(self.cppn, 2, 3, 0)
+        assert os.path.exists(paths[0]) and not os.path.exists(paths[1]) and os.path.exists(paths[2])
+
+    def test_prerender(self):
+        self.cppn.normalize_outputs = "min_max"
+        assert self.pyramid.prerender(self.cppn, 3, processes=2) == 1 + 4 + 16
+        assert self.pyramid.prerender(self.cppn, 3, processes=2) == 0
+        key = self.pyramid.tile_key(self.cppn)
+        path = self.pyramid.tile_path(key, 2, 1, 2)
+        tile = self.read(path)
+        os.remove(path)
+        self.pyramid.index.pop(path)
+        assert np.array_equal(tile, self.read(self.pyramid.get_tile(self.cppn, 2, 1, 2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
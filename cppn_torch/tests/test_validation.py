@@ -0,0 +1,22 @@
+import unittest
+import torch
+
+from fixtures import GenomeTest
+
+class TestValidation(GenomeTest):
+    def test_validation(self):
+        node = self.cppn.node_genome[self.cppn.get_plan().output_ids[0]]
+        node.activation = lambda x: torch.log(x - 100.0) # nan everywhere
+        self.cppn.invalidate_plan()
+        self.cppn.validation = 'off'
+        self.cppn(self.inputs, act_mode='layer')
+        self.cppn.validation = 'final'
+        with self.assertRaisesRegex(RuntimeError, f"nodes \\[{node.id}\\]"):
+            self.cppn(self.inputs, act_mode='layer')
+        self.cppn.validation = 'per_node'
+        with self.assertRaises(AssertionError):
+            self.cppn(self.inputs, act_mode='node')
+
+
+if __name__ == "__main__":
+    unittest.main()
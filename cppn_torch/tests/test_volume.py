@@ -0,0 +1,27 @@
+import os
+import tempfile
+import unittest
+
+import torch
+
+from cppn_torch.volume import render_volume, volume_inputs
+from fixtures import make_config, grow_cppn
+
+class TestVolume(unittest.TestCase):
+    def test_slabs_match_volume(self):
+        config = make_config(radial=True, bias=True, extra_inputs=1) # z
+        cppn = grow_cppn(config)
+        z, y, x = (torch.linspace(-0.5, 0.5, n) for n in (10, 12, 11))
+        inputs = volume_inputs(z, y, x, True, True, 5)
+        assert torch.allclose(inputs[3, 4, 5], torch.tensor([y[4], x[5], z[3], (y[4]**2 + x[5]**2 + z[3]**2).sqrt(), 1.0]))
+        with torch.no_grad():
+            volume = cppn.forward(inputs, channel_first=False, act_mode='node')
+        with tempfile.TemporaryDirectory() as directory:
+            out = render_volume(cppn, config, os.path.join(directory, "volume.npy"), (10, 12, 11), slab_depth=4)
+            assert out.shape == (10, 12, 11, 3)
+            assert torch.allclose(torch.from_numpy(out[:]), volume, atol=1e-5)
+            del out
+
+
+if __name__ == "__main__":
+    unittest.main()
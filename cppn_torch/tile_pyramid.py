@@ -0,0 +1,231 @@
+"""Deep-zoom tile pyramids of CPPN images with an on-disk tile cache."""
+import hashlib
+import os
+import pickle
+import struct
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import torch
+from torch import nn
+
+from cppn_torch.cppn import CPPN, coord_ranges
+from cppn_torch.normalization import needs_global_stats
+from cppn_torch.render import PNGWriter, TileStats, postprocess_tile, tile_inputs, to_uint8
+
+
+def genome_hash(cppn, settings=()):
+    """Returns a hex digest of everything that changes the image of the CPPN,
+    and of the (repr-able) rendering `settings`."""
+    h = hashlib.sha1()
+    h.update(repr(settings).encode())
+    h.update(repr((cppn.n_in_nodes, cppn.n_outputs, cppn.normalize_outputs, cppn.color_mode)).encode())
+    for node_id in sorted(cppn.node_genome):
+        node = cppn.node_genome[node_id]
+        fn = node.activation
+        h.update(repr((node_id, getattr(fn, "__name__", type(fn).__name__), node.agg)).encode())
+        h.update(struct.pack(">d", torch.as_tensor(node.bias).item()))
+        if isinstance(fn, nn.Module):
+            for p in fn.parameters():
+                h.update(p.detach().cpu().numpy().tobytes())
+    for key in sorted(cppn.connection_genome):
+        cx = cppn.connection_genome[key]
+        h.update(repr((key, bool(cx.enabled))).encode())
+        h.update(struct.pack(">d", torch.as_tensor(cx.weight).item()))
+    return h.hexdigest()
+
+
+class PlaneStats(TileStats):
+    """`TileStats` of the whole coordinate plane, for tiles at any zoom level.
+
+    Measured at level 0, so deeper tiles can hold values outside the
+    measured range. Raw values are clamped into it before normalizing and,
+    as the outputs are continuous, the value closest to zero is taken as
+    zero when the range spans it, so no tile changes the statistics and
+    neighboring tiles (at any level) are normalized alike.
+    """
+
+    def __init__(self, stats):
+        low, high, closest = stats.sentinels("min_max", 0, 1)[:, :, 0].unbind(1)
+        closest = torch.where((low <= 0) & (high >= 0), torch.zeros_like(closest), closest)
+        self.low, self.high = low.view(-1, 1, 1), high.view(-1, 1, 1)
+        self.columns = torch.stack([low, high, closest], dim=1).unsqueeze(-1)
+
+    def clamp(self, X):
+        return torch.minimum(torch.maximum(X, self.low), self.high)
+
+    def sentinels(self, norm, col, width):
+        return self.columns.expand(-1, -1, width)
+
+
+class TilePyramid:
+    """Renders and caches the tiles of a deep-zoom pyramid.
+
+    Level `zoom` covers `config.coord_range` with 2**zoom x 2**zoom tiles of
+    `tile_size` x `tile_size` pixels, tile (tx, ty) being column tx and row
+    ty. Pixel coordinates are spaced as in `CPPN.initialize_inputs`, so
+    level 0 is the image at `tile_size` resolution. Tiles are stored as PNGs
+    in `cache_dir/<key>/<zoom>/<tx>_<ty>.png`, where the key hashes the genome
+    and the settings that change its tiles (see `tile_key`), and the least
+    recently used ones are deleted once there are more than `cache_size`.
+    The `PlaneStats` of the last `stats_size` genomes are kept in memory.
+    """
+
+    def __init__(self, config, cache_dir, cache_size=4096, tile_size=256, act_mode='layer', stats_size=64):
+        self.config = config
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.tile_size = tile_size
+        self.act_mode = act_mode
+        self.stats_size = stats_size
+        self.stats = OrderedDict() # tile key -> PlaneStats, least recently used first
+        self.index = OrderedDict() # tile path -> None, least recently used first
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load_index()
+
+    def load_index(self):
+        """Finds the tiles already in the cache directory, oldest first."""
+        tiles = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".png"):
+                    path = os.path.join(root, name)
+                    tiles.append((os.path.getmtime(path), path))
+        self.index = OrderedDict((path, None) for _, path in sorted(tiles))
+        self.evict()
+
+    def tile_key(self, cppn):
+        """Returns the key of the tiles of the CPPN."""
+        config = self.config
+        settings = (coord_ranges(config.coord_range), bool(config.use_radial_distance),
+                    bool(config.use_input_bias), str(config.dtype), self.tile_size)
+        return genome_hash(cppn, settings)
+
+    def tile_path(self, key, zoom, tx, ty):
+        return os.path.join(self.cache_dir, key, str(zoom), f"{tx}_{ty}.png")
+
+    def coordinates(self, zoom, tx, ty):
+        """Returns the (y_vals, x_vals) of a tile."""
+        (x_lo, x_hi), (y_lo, y_hi) = coord_ranges(self.config.coord_range)
+        n = self.tile_size * 2**zoom
+        # float64 keeps neighboring pixels apart at deep zoom levels
+        steps = torch.arange(self.tile_size, dtype=torch.float64)
+        x_vals = x_lo + (x_hi - x_lo) * (tx * self.tile_size + steps) / (n - 1)
+        y_vals = y_lo + (y_hi - y_lo) * (ty * self.tile_size + steps) / (n - 1)
+        return y_vals, x_vals
+
+    def raw_tile(self, cppn, zoom, tx, ty):
+        """Returns the (C, tile_size, tile_size) outputs of a tile before normalization."""
+        config = self.config
+        y_vals, x_vals = self.coordinates(zoom, tx, ty)
+        to = dict(dtype=config.dtype, device=cppn.device)
+        inputs = tile_inputs(y_vals.to(**to), x_vals.to(**to), config.use_radial_distance,
+                             config.use_input_bias, cppn.n_in_nodes)
+        with cppn.inference():
+            return CPPN.forward(cppn, inputs, channel_first=True, act_mode=self.act_mode)
+
+    def plane_stats(self, cppn, key):
+        """Returns the `PlaneStats` of the CPPN, or None if its normalization does not need them."""
+        if not needs_global_stats(cppn.normalize_outputs):
+            return None
+        if 'min_max_channel' in cppn.normalize_outputs:
+            raise ValueError("min_max_channel normalizes every column separately, which differs between zoom levels.")
+        if key not in self.stats:
+            stats = TileStats(cppn.n_outputs, self.tile_size, cppn.device)
+            stats.update(self.raw_tile(cppn, 0, 0, 0), 0)
+            self.stats[key] = PlaneStats(stats)
+            while len(self.stats) > self.stats_size:
+                self.stats.popitem(last=False) # least recently used
+        self.stats.move_to_end(key)
+        return self.stats[key]
+
+    def render_tile(self, cppn, zoom, tx, ty, stats=None):
+        """Returns a (tile_size, tile_size, C) uint8 tile."""
+        X = self.raw_tile(cppn, zoom, tx, ty)
+        if stats is not None:
+            X = stats.clamp(X)
+        return to_uint8(postprocess_tile(cppn, X, stats))
+
+    def check_cppn(self, cppn, zoom, tx, ty):
+        if cppn.output_blur > 0:
+            raise ValueError("Output blur mixes neighboring pixels and cannot be applied to tiles.")
+        if not (0 <= tx < 2**zoom and 0 <= ty < 2**zoom):
+            raise ValueError(f"Tile ({tx}, {ty}) is outside of zoom level {zoom}")
+
+    def get_tile(self, cppn, zoom, tx, ty):
+        """Returns the path of the tile, rendering it if it is not cached."""
+        self.check_cppn(cppn, zoom, tx, ty)
+        key = self.tile_key(cppn)
+        path = self.tile_path(key, zoom, tx, ty)
+        if path in self.index and os.path.exists(path):
+            self.index.move_to_end(path)
+            os.utime(path) # keeps the order when the index is reloaded
+            return path
+        write_tile(path, self.render_tile(cppn, zoom, tx, ty, self.plane_stats(cppn, key)))
+        self.add(path)
+        return path
+
+    def add(self, path):
+        self.index[path] = None
+        self.index.move_to_end(path)
+        self.evict()
+
+    def evict(self):
+        """Deletes the least recently used tiles beyond `cache_size`."""
+        while len(self.index) > self.cache_size:
+            path, _ = self.index.popitem(last=False)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def prerender(self, cppn, levels, processes=None):
+        """Renders all tiles of the top `levels` zoom levels that are not cached.
+
+        Tiles are rendered in a pool of `processes` processes (defaults to
+        the number of CPUs). Returns the number of rendered tiles.
+        """
+        self.check_cppn(cppn, 0, 0, 0)
+        key = self.tile_key(cppn)
+        stats = self.plane_stats(cppn, key)
+        todo = [(zoom, tx, ty) for zoom in range(levels) for ty in range(2**zoom) for tx in range(2**zoom)
+                if not os.path.exists(self.tile_path(key, zoom, tx, ty))]
+        if len(todo) == 0:
+            return 0
+        state = pickle.dumps((self, cppn, key, stats))
+        # spawn: forked workers cannot use CUDA
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=init_worker, initargs=(state,)) as pool:
+            for path in pool.map(prerender_tile, todo, chunksize=max(1, len(todo) // (4 * (processes or os.cpu_count())))):
+                self.add(path)
+        return len(todo)
+
+    def __getstate__(self):
+        # workers do not need the index or the stats of other genomes
+        state = self.__dict__.copy()
+        state["index"] = OrderedDict()
+        state["stats"] = OrderedDict()
+        return state
+
+
+def write_tile(path, tile):
+    """Writes a (h, w, C) uint8 tile, atomically so that readers never see part of it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    writer = PNGWriter(tmp, tile.shape[0], tile.shape[1], tile.shape[2])
+    writer.write(tile)
+    writer.close()
+    os.replace(tmp, path)
+
+
+worker_state = None
+
+def init_worker(state):
+    global worker_state
+    torch.set_num_threads(1) # one process per core
+    worker_state = pickle.loads(state)
+
+def prerender_tile(address):
+    pyramid, cppn, key, stats = worker_state
+    path = pyramid.tile_path(key, *address)
+    write_tile(path, pyramid.render_tile(cppn, *address, stats))
+    return path
@@ -6,8 +6,10 @@ import networkx as nx
 import sys
 import inspect
 import random
+from functools import lru_cache
 from torch import nn
 import torch
+import torch.nn.functional as F
 from typing import List, Union
 from cv2 import resize as cv2_resize
 
@@ -15,7 +17,6 @@ from cppn_torch.cppn import NodeType
 from cppn_torch.graph_util import feed_forward_layers, get_ids_from_individual, get_incoming_connections_weights, required_for_output
 from cppn_torch.normalization import handle_normalization
    
-from torchvision.transforms import GaussianBlur
    
 def visualize_network(individual, config, sample_point=None, color_mode="L", visualize_disabled=False, layout='multi', sample=False, show_weights=False, use_inp_bias=False, use_radial_distance=True, save_name=None, extra_text=None, curved=False, return_fig=False):
     c = config
@@ -293,7 +294,7 @@ def visualize_node_outputs(net, inputs):
     batch_size = 1 
     
     if inputs is None:
-        inputs = type(net).constant_inputs
+        raise ValueError("visualize_node_outputs needs the inputs the network was activated with")
 
     res_h = inputs.shape[0]
     res_w = inputs.shape[1]
@@ -429,8 +430,35 @@ def visualize_node_outputs(net, inputs):
     plt.show()
         
 
-def gaussian_blur(img, sigma, kernel_size=(5,5)):
-    return GaussianBlur(kernel_size=kernel_size, sigma=sigma)(img)
+def blur_kernel_size(sigma):
+    """Returns the odd kernel size that covers +-3 sigma."""
+    return 2 * math.ceil(3 * sigma) + 1
+
+@lru_cache(maxsize=64)
+@torch.inference_mode(False) # kernels are used by forward passes that need gradients
+def gaussian_kernel(sigma, kernel_size, dtype, device):
+    """Returns a normalized 1D Gaussian kernel, cached per (sigma, size, dtype, device)."""
+    x = torch.arange(kernel_size, dtype=torch.float64) - (kernel_size - 1) / 2
+    kernel = torch.exp(-0.5 * (x / sigma) ** 2)
+    return (kernel / kernel.sum()).to(dtype=dtype, device=device)
+
+def gaussian_blur(img, sigma, kernel_size=None):
+    """Blurs (C, H, W) or (B, C, H, W) images with a separable Gaussian kernel.
+
+    Runs as two depthwise 1D convolutions with reflected borders. The kernel
+    size defaults to `blur_kernel_size(sigma)` and can be an int or (h, w).
+    """
+    if kernel_size is None:
+        kernel_size = blur_kernel_size(sigma)
+    kh, kw = (kernel_size, kernel_size) if isinstance(kernel_size, int) else kernel_size
+    shape = img.shape
+    X = img.reshape(-1, 1, *shape[-2:]) # every channel of every image is blurred separately
+    pad_h, pad_w = kh // 2, kw // 2
+    mode = 'reflect' if pad_h < shape[-2] and pad_w < shape[-1] else 'replicate'
+    X = F.pad(X, (pad_w, pad_w, pad_h, pad_h), mode=mode)
+    X = F.conv2d(X, gaussian_kernel(float(sigma), kw, X.dtype, X.device).view(1, 1, 1, kw))
+    X = F.conv2d(X, gaussian_kernel(float(sigma), kh, X.dtype, X.device).view(1, 1, kh, 1))
+    return X.reshape(shape)
         
         
 def resize(img, size):
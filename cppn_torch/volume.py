@@ -0,0 +1,53 @@
+"""Renders volumetric (3D) CPPN fields in z-slabs."""
+import numpy as np
+import torch
+
+from cppn_torch.cppn import CPPN, coord_ranges, coordinate_inputs, coordinate_values
+
+
+def volume_inputs(z_vals, y_vals, x_vals, use_radial_dist, use_bias, n_inputs, out=None):
+    """Builds the (len(z_vals), len(y_vals), len(x_vals), n_inputs) inputs of a slab.
+
+    Channels are y, x and z, followed by the 3D radial distance and the bias,
+    so the first two channels are the same as in `CPPN.initialize_inputs`.
+    `out` is filled in place if it is given.
+    """
+    d, h, w = z_vals.shape[0], y_vals.shape[0], x_vals.shape[0]
+    if n_inputs != 3 + use_radial_dist + use_bias:
+        raise ValueError(f"Volume inputs have {3 + use_radial_dist + use_bias} channels, expected {n_inputs}")
+    return coordinate_inputs((y_vals.view(1, h, 1), x_vals.view(1, 1, w), z_vals.view(d, 1, 1)),
+                             use_radial_dist, use_bias, n_inputs, out=out)
+
+
+@torch.inference_mode()
+def render_volume(cppn, config, path, res, slab_depth=16, z_range=None, act_mode='layer'):
+    """Renders the CPPN over a 3D grid into a (D, H, W, C) float32 .npy memmap.
+
+    The grid is evaluated in slabs of `slab_depth` z-slices (see
+    `CPPN.forward` for batches), so peak memory is bounded by the slab size.
+    The input buffer of a slab is reused between slabs. Values are the raw
+    outputs of the network (e.g. densities), without image normalization.
+
+    params:
+        config: Provides `coord_range` for y and x and the input layout.
+        res: (D, H, W) or a single resolution for all axes.
+        z_range: The range of z, defaults to the range of x.
+    returns:
+        The memmap.
+    """
+    res_d, res_h, res_w = (res, res, res) if isinstance(res, int) else res
+    y_vals, x_vals = coordinate_values(config.coord_range, res_h, res_w, cppn.device, config.dtype)
+    if z_range is None:
+        z_range = coord_ranges(config.coord_range)[0]
+    z_vals = torch.linspace(z_range[0], z_range[1], res_d, device=cppn.device, dtype=config.dtype)
+
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(res_d, res_h, res_w, cppn.n_outputs))
+    buffer = torch.empty((min(slab_depth, res_d), res_h, res_w, cppn.n_in_nodes), dtype=config.dtype, device=cppn.device)
+    for z in range(0, res_d, slab_depth):
+        slab = z_vals[z:z + slab_depth]
+        inputs = volume_inputs(slab, y_vals, x_vals, config.use_radial_distance, config.use_input_bias,
+                               cppn.n_in_nodes, out=buffer[:slab.shape[0]])
+        outputs = CPPN.forward(cppn, inputs, channel_first=False, act_mode=act_mode)
+        out[z:z + slab.shape[0]] = outputs.cpu().numpy()
+    out.flush()
+    return out